@@ -0,0 +1,98 @@
+import sys
+import threading
+
+from benchmarks.fakes import FakeAppStoreAPI
+from src.scraping import RateLimitedAppStore, RateLimitError, TokenBucket
+
+
+def _scraper(**kwargs):
+    # A limiter of its own, so that the checks do not wait for each other
+    return RateLimitedAppStore(
+        country="us",
+        app_name="check",
+        app_id=1,
+        rate_limiter=TokenBucket(rate=1000, capacity=1000),
+        backoff_base=0.01,
+        **kwargs,
+    )
+
+
+def check_full_scrape():
+    pages = []
+    with FakeAppStoreAPI(total_reviews=95, page_latency=0).installed():
+        app = _scraper(on_page=pages.append)
+        app.review(how_many=1000)
+
+    problems = []
+    if len(app.reviews) != 95:
+        problems.append(f"expected 95 reviews, got {len(app.reviews)}")
+    if [len(page) for page in pages] != [20, 20, 20, 20, 15]:
+        problems.append(f"unexpected pages reported: {[len(page) for page in pages]}")
+    return problems
+
+
+def check_stop_event():
+    stop_event = threading.Event()
+    with FakeAppStoreAPI(total_reviews=1000, page_latency=0).installed():
+        app = _scraper(stop_event=stop_event, on_page=lambda page: stop_event.set())
+        app.review(how_many=1000)
+
+    if len(app.reviews) != 20:
+        return [f"expected scraping to stop after the first page, got {len(app.reviews)} reviews"]
+    return []
+
+
+def check_rate_limit_error():
+    # AppStore.review() swallows errors, RateLimitedAppStore must raise them
+    with FakeAppStoreAPI(total_reviews=1000, page_latency=0, rate_limited_after=1).installed():
+        app = _scraper()
+        try:
+            app.review(how_many=1000)
+        except RateLimitError:
+            pass
+        else:
+            return ["expected a RateLimitError after the first page"]
+
+    if len(app.reviews) != 20:
+        return [f"expected the first page to be kept, got {len(app.reviews)} reviews"]
+    return []
+
+
+def check_no_library_retries():
+    # 429 retries and backoff must go through the shared rate limiter, not
+    # through the urllib3 retries of the library's session
+    with FakeAppStoreAPI(total_reviews=40, page_latency=0).installed() as api:
+        _scraper().review(how_many=1000)
+
+    retried = [kwargs for kwargs in api.retry_settings if kwargs.get("total") != 0]
+    if retried:
+        return [f"{len(retried)} requests used the library's retries: {retried[0]}"]
+    return []
+
+
+CHECKS = [check_full_scrape, check_stop_event, check_rate_limit_error, check_no_library_retries]
+
+
+def main():
+    """Run RateLimitedAppStore against the fake HTTP layer of the App Store.
+
+    Unlike the benchmarks, these checks need no network and no LLM, and
+    they fail fast if the scraper subclass no longer works with the
+    scraper library.
+    """
+    n_failed = 0
+    for check in CHECKS:
+        try:
+            problems = check()
+        except Exception as e:
+            problems = [f"{type(e).__name__}: {e}"]
+        for problem in problems:
+            print(f"FAILED {check.__name__}: {problem}", file=sys.stderr)
+        n_failed += bool(problems)
+        if not problems:
+            print(f"ok     {check.__name__}")
+    return 1 if n_failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
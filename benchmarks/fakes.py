@@ -0,0 +1,223 @@
+import csv
+import json
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+
+SAMPLE_DATA_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "reviews_test_data.csv"
+)
+
+
+class ReviewGenerator:
+    """Generates synthetic reviews by recombining titles and sentences of
+    the demo dataset, with the demo dataset's rating distribution."""
+
+    def __init__(self, path: str = SAMPLE_DATA_PATH, seed: int = 0):
+        self.rng = random.Random(seed)
+        self.titles = {}
+        self.sentences = {}
+        with open(path, encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                rating = int(row["rating"])
+                self.titles.setdefault(rating, []).append(row["title"])
+                self.sentences.setdefault(rating, []).extend(
+                    sentence
+                    for sentence in re.split(r"(?<=[.!?])\s+", row["review"])
+                    if sentence
+                )
+        self.ratings = [rating for rating, titles in self.titles.items() for _ in titles]
+
+    def review(self, date: datetime):
+        rating = self.rng.choice(self.ratings)
+        n_sentences = self.rng.randint(1, 5)
+        return {
+            "date": date,
+            "title": self.rng.choice(self.titles[rating]),
+            "review": " ".join(self.rng.choices(self.sentences[rating], k=n_sentences)),
+            "rating": rating,
+            "isEdited": False,
+            "userName": f"user{self.rng.randrange(10**6)}",
+        }
+
+    def reviews(self, n: int, newest: datetime = None, spacing: timedelta = timedelta(minutes=7)):
+        newest = newest or datetime.now()
+        return [self.review(newest - i * spacing) for i in range(n)]
+
+
+def synthetic_reviews(n: int, seed: int = 0):
+    reviews = pd.DataFrame(ReviewGenerator(seed=seed).reviews(n))
+    return reviews.loc[:, ["date", "title", "review", "rating"]]
+
+
+class _FakeResponse:
+    def __init__(self, status_code: int, text: str = "", payload: dict = None):
+        self.status_code = status_code
+        self.text = text
+        self._payload = payload
+
+    def json(self):
+        return self._payload
+
+
+class FakeAppStoreAPI:
+    """Fake HTTP layer of the App Store scraper.
+
+    While installed, the scraper classes (including RateLimitedAppStore)
+    run their own code, and only their HTTP requests are answered here: the
+    token page and pages of synthetic reviews (newest first), each after
+    `page_latency` seconds. After `rate_limited_after` review pages, every
+    request is answered with a 429 error.
+    """
+
+    page_size = 20
+
+    def __init__(
+        self,
+        total_reviews: int = 10_000,
+        page_latency: float = 0.05,
+        rate_limited_after: int = None,
+    ):
+        self.total_reviews = total_reviews
+        self.page_latency = page_latency
+        self.rate_limited_after = rate_limited_after
+        self.n_pages = 0
+        self.retry_settings = []
+        self._newest = datetime.now()
+        self._generator = ReviewGenerator()
+        self._lock = threading.Lock()
+
+    def _token_page(self):
+        return _FakeResponse(
+            200,
+            text='<meta name="web-experience-app/config/environment" '
+            'content="%7B%22token%22%3A%22fake-token%22%7D">',
+        )
+
+    def _review_page(self, scraper, offset: int):
+        end = min(offset + self.page_size, self.total_reviews)
+        data = []
+        with self._lock:
+            self.n_pages += 1
+            if self.rate_limited_after is not None and self.n_pages > self.rate_limited_after:
+                return _FakeResponse(429)
+
+            # The same page always has the same reviews
+            self._generator.rng.seed(f"{scraper.country}/{scraper.app_id}/{offset}")
+            for i in range(offset, end):
+                review = self._generator.review(self._newest - i * timedelta(minutes=7))
+                review["date"] = review["date"].strftime("%Y-%m-%dT%H:%M:%SZ")
+                data.append({"id": str(i), "type": "user-reviews", "attributes": review})
+
+        payload = {"data": data}
+        if end < self.total_reviews:
+            payload["next"] = (
+                f"/v1/catalog/{scraper.country}/apps/{scraper.app_id}/reviews?offset={end}"
+            )
+        return _FakeResponse(200, payload=payload)
+
+    def get(self, scraper, url, headers=None, params=None, **kwargs):
+        # Retry settings passed to the library's session (e.g. total=0)
+        self.retry_settings.append(kwargs)
+        time.sleep(self.page_latency)
+        if url == scraper.url:
+            scraper._response = self._token_page()
+        else:
+            offset = int((params or {}).get("offset") or 0)
+            scraper._response = self._review_page(scraper, offset)
+
+    @contextmanager
+    def installed(self):
+        from app_store_scraper.base import Base
+
+        api = self
+        original_get = Base._get
+
+        def _get(scraper, url, headers=None, params=None, **kwargs):
+            api.get(scraper, url, headers=headers, params=params, **kwargs)
+
+        Base._get = _get
+        try:
+            yield self
+        finally:
+            Base._get = original_get
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    latency = 0.5
+    response_text = (
+        "- **Stable messaging**: Users value reliable notifications. They rely on it daily.\n"
+        "- **Status handling**: Setting a status is cumbersome. It often needs two attempts.\n"
+        "- **Huddles**: Calls work well. Users want more control over audio.\n"
+    )
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        time.sleep(self.latency)
+
+        prompt_tokens = sum(len(m.get("content", "")) for m in request.get("messages", [])) // 4
+        completion_tokens = len(self.response_text) // 4
+        base = {
+            "id": "chatcmpl-stub",
+            "created": int(time.time()),
+            "model": request.get("model", "gpt-3.5-turbo"),
+        }
+
+        if request.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            for word in re.findall(r"\S+\s*", self.response_text):
+                chunk = dict(
+                    base,
+                    object="chat.completion.chunk",
+                    choices=[{"index": 0, "delta": {"content": word}, "finish_reason": None}],
+                )
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.write(b"data: [DONE]\n\n")
+            return
+
+        body = dict(
+            base,
+            object="chat.completion",
+            choices=[
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": self.response_text},
+                    "finish_reason": "stop",
+                }
+            ],
+            usage={
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        )
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def start_stub_openai_server(latency: float = 0.5, port: int = 0):
+    """Start a local OpenAI-compatible chat completions server in a thread.
+
+    Returns the server (call `shutdown()` when done) and its base URL.
+    """
+    handler = type("StubHandler", (_StubHandler,), {"latency": latency})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
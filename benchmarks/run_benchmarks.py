@@ -0,0 +1,238 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+
+from benchmarks.fakes import FakeAppStoreAPI, start_stub_openai_server, synthetic_reviews
+
+import src.analytics as analytics
+import src.pipeline as pipeline
+import src.scraping as scraping
+import src.utils as utils
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def timed(fn, repeat: int = 3):
+    # Best wall time of several runs (in seconds)
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_build_prompt(reviews, repeat):
+    return {"build_prompt": timed(lambda: utils.build_prompt(reviews), repeat)}
+
+
+def bench_count_tokens(reviews, repeat):
+    prompt = utils.build_prompt(reviews)
+    review_texts = utils.format_reviews(reviews)
+
+    # The first batch count fills the memo, later ones hit it
+    utils.tokenizer = utils.Tokenizer()
+    cold = timed(lambda: utils.count_tokens_batch(review_texts), repeat=1)
+    return {
+        "count_tokens (whole prompt)": timed(lambda: utils.count_tokens(prompt), repeat),
+        "count_tokens_batch (cold)": cold,
+        "count_tokens_batch (memoized)": timed(
+            lambda: utils.count_tokens_batch(review_texts), repeat
+        ),
+    }
+
+
+def bench_analytics(reviews, repeat):
+    buckets = analytics.sentiment_buckets(reviews)
+    return {
+        "rating_trend": timed(lambda: analytics.rating_trend(reviews), repeat),
+        "top_ngrams": timed(lambda: analytics.top_ngrams(reviews, buckets=buckets), repeat),
+    }
+
+
+@contextmanager
+def fake_app_store(n_reviews, page_latency):
+    # The real scraper runs against a fake HTTP layer. The shared rate limiter
+    # would dominate the timings, so it is lifted while the fake is installed.
+    limiter = scraping.RATE_LIMITER
+    rate, capacity = limiter.rate, limiter.capacity
+    limiter.rate = limiter.capacity = 1e9
+    try:
+        with FakeAppStoreAPI(total_reviews=n_reviews, page_latency=page_latency).installed():
+            yield
+    finally:
+        limiter.rate, limiter.capacity = rate, capacity
+
+
+def bench_scraping(n_reviews, repeat):
+    with fake_app_store(n_reviews, page_latency=0):
+        return {
+            "app_store_reviews (no page latency)": timed(
+                lambda: utils.app_store_reviews(
+                    "https://apps.apple.com/us/app/bench/id1",
+                    n_last_reviews=n_reviews,
+                ),
+                repeat,
+            )
+        }
+
+
+def bench_insights(reviews, repeat, model):
+    def run():
+        positive_reviews, negative_reviews = utils.split_reviews(
+            reviews, max_representative_reviews=300
+        )
+        utils.generate_insights(
+            positive_reviews=positive_reviews,
+            negative_reviews=negative_reviews,
+            app_name="bench",
+            positive_instruction=utils.POSITIVE_INSTRUCTION,
+            negative_instruction=utils.NEGATIVE_INSTRUCTION,
+            model=model,
+        )
+
+    return {"split_reviews + generate_insights": timed(run, repeat)}
+
+
+def bench_pipeline(n_reviews, page_latency, model):
+    # End-to-end latency of scraping and summarizing: one stage after the
+    # other vs. summarizing early pages while later ones are scraped
+    url = "https://apps.apple.com/us/app/bench/id2"
+
+    def staged():
+        reviews = utils.app_store_reviews(url, n_last_reviews=n_reviews)
+        positive_reviews, negative_reviews = utils.split_reviews(reviews)
+        utils.generate_insights(
+            positive_reviews=positive_reviews,
+            negative_reviews=negative_reviews,
+            app_name="bench",
+            positive_instruction=utils.POSITIVE_INSTRUCTION,
+            negative_instruction=utils.NEGATIVE_INSTRUCTION,
+            model=model,
+        )
+
+    with fake_app_store(n_reviews, page_latency):
+        return {
+            "scrape, then summarize": timed(staged, repeat=1),
+            "scrape_and_summarize (pipelined)": timed(
+                lambda: pipeline.scrape_and_summarize(url, n_last_reviews=n_reviews, model=model),
+                repeat=1,
+            ),
+        }
+
+
+def bench_startup(repeat):
+    # Every run starts a fresh interpreter, so nothing is imported yet
+    def run(code):
+        subprocess.run([sys.executable, "-c", code], cwd=REPO_DIR, check=True)
+
+    return {
+        "python startup (reference)": timed(lambda: run("pass"), repeat),
+        "import src.utils": timed(lambda: run("import src.utils"), repeat),
+        "import src.utils + first count_tokens": timed(
+            lambda: run("import src.utils; src.utils.count_tokens('warm-up')"), repeat
+        ),
+    }
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    regressions = []
+    for size, metrics in results.items():
+        for name, seconds in metrics.items():
+            reference = baseline.get(size, {}).get(name)
+            if reference is not None and seconds > reference * tolerance:
+                regressions.append(f"{name} @ {size} reviews: {seconds:.3f}s vs. {reference:.3f}s")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the review pipeline offline.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 10_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--latency", type=float, default=0.5, help="Latency of the stub OpenAI server (seconds)"
+    )
+    parser.add_argument("--model", default="gpt-3.5-turbo")
+    parser.add_argument(
+        "--pipeline-reviews",
+        type=int,
+        default=2000,
+        help="Number of reviews for the scrape-and-summarize pipeline benchmark",
+    )
+    parser.add_argument(
+        "--page-latency",
+        type=float,
+        default=0.05,
+        help="Latency of every page of the fake App Store in the pipeline benchmark (seconds)",
+    )
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=1.5,
+        help="Fail if a benchmark is slower than the baseline by this factor",
+    )
+    args = parser.parse_args(argv)
+
+    # Token counts need the tokenizer files, which are only downloaded once
+    try:
+        utils.warm_tokenizer()
+    except Exception as e:
+        print(
+            f"The tokenizer files could not be loaded ({type(e).__name__}: {e}). Run "
+            "`python -m src.warm_tokenizer` once with network access, then benchmark offline.",
+            file=sys.stderr,
+        )
+        return 2
+
+    # Route all LLM calls to the local stub and bypass the completion cache
+    server, base_url = start_stub_openai_server(latency=args.latency)
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ["OPENAI_API_KEY"] = "stub"
+    utils.completion_cache = None
+
+    results = {}
+    try:
+        results["startup"] = bench_startup(args.repeat)
+        for name, seconds in results["startup"].items():
+            print(f"{'startup':>17}  {name:<40} {seconds * 1000:>10.1f} ms")
+
+        results["pipeline"] = bench_pipeline(args.pipeline_reviews, args.page_latency, args.model)
+        for name, seconds in results["pipeline"].items():
+            print(f"{'pipeline':>17}  {name:<40} {seconds * 1000:>10.1f} ms")
+
+        for size in args.sizes:
+            reviews = synthetic_reviews(size)
+            metrics = {}
+            metrics.update(bench_build_prompt(reviews, args.repeat))
+            metrics.update(bench_count_tokens(reviews, args.repeat))
+            metrics.update(bench_analytics(reviews, args.repeat))
+            metrics.update(bench_scraping(size, args.repeat))
+            metrics.update(bench_insights(reviews, args.repeat, args.model))
+            results[str(size)] = metrics
+
+            for name, seconds in metrics.items():
+                print(f"{size:>9} reviews  {name:<40} {seconds * 1000:>10.1f} ms")
+    finally:
+        server.shutdown()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare_to_baseline(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,236 @@
+import hashlib
+import io
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from src.cache import DEFAULT_CACHE_DIR
+
+_TOKEN_PATTERN = r"\w\w+"
+
+RATINGS = [1, 2, 3, 4, 5]
+
+# Frequent terms of larger datasets are estimated from a sample of this size
+KEYWORD_SAMPLE_SIZE = 20_000
+
+
+def sentiment_buckets(reviews: pd.DataFrame):
+    # Same split as the summaries: more than 3 stars is positive
+    return pd.Series(
+        np.where(reviews["rating"].to_numpy() > 3, "positive", "negative"),
+        index=reviews.index,
+    )
+
+
+def rating_distribution(reviews: pd.DataFrame):
+    return reviews["rating"].value_counts().reindex(RATINGS, fill_value=0)
+
+
+def rating_trend(reviews: pd.DataFrame, freq: str = "W-SUN"):
+    """Number of reviews per rating and period (calendar weeks by default),
+    with the mean rating and the share of positive reviews per period."""
+    periods = pd.to_datetime(reviews["date"], errors="coerce").dt.to_period(freq).dt.start_time
+    counts = (
+        reviews.groupby([periods.rename("period"), reviews["rating"].to_numpy()])
+        .size()
+        .unstack(fill_value=0)
+        .reindex(columns=RATINGS, fill_value=0)
+    )
+    totals = counts.sum(axis=1)
+    trend = counts.assign(
+        reviews=totals,
+        mean_rating=(counts * np.array(RATINGS)).sum(axis=1) / totals,
+        share_positive=counts[[4, 5]].sum(axis=1) / totals,
+    )
+    return trend
+
+
+def _ngram_matrix(tokens: np.ndarray, docs: np.ndarray, stop: np.ndarray, n: int, n_docs: int):
+    # Binary document-term matrix of the n-grams that neither start nor end
+    # with a stopword (tokens of a document are contiguous)
+    from scipy import sparse
+
+    if len(tokens) < n:
+        return sparse.csr_matrix((n_docs, 0)), np.array([], dtype=object)
+    last = np.arange(n - 1, len(tokens))
+    first = last - (n - 1)
+    valid = (docs[first] == docs[last]) & ~stop[first] & ~stop[last]
+    first, last = first[valid], last[valid]
+
+    terms = tokens[first]
+    for offset in range(1, n):
+        terms = terms + " " + tokens[first + offset]
+    codes, vocabulary = pd.factorize(terms)
+
+    matrix = sparse.csr_matrix(
+        (np.ones(len(codes), dtype=np.int32), (docs[first], codes)),
+        shape=(n_docs, len(vocabulary)),
+    )
+    matrix.sum_duplicates()
+    matrix.data[:] = 1
+    return matrix, np.asarray(vocabulary, dtype=object)
+
+
+def top_ngrams(
+    reviews: pd.DataFrame,
+    buckets: pd.Series = None,
+    top_n: int = 20,
+    max_n: int = 2,
+    max_df: float = 0.3,
+    min_count: int = 2,
+    stopwords=(),
+    max_reviews: int = KEYWORD_SAMPLE_SIZE,
+    seed: int = 0,
+):
+    """Most frequent words and phrases (up to `max_n` words) per bucket.
+
+    Frequencies are the number of reviews mentioning a term. Words found in
+    more than `max_df` of all reviews (or in `stopwords`) are treated as
+    stopwords, which works without a word list for any language. Buckets
+    default to the star rating. Above `max_reviews`, the frequencies are
+    estimated from a uniform sample (and scaled to all reviews). Returns a
+    DataFrame with the columns bucket, term and reviews per bucket.
+    """
+    # Imported here, scipy is slow to import and only needed for keywords
+    from scipy import sparse
+
+    if buckets is None:
+        buckets = reviews["rating"]
+    n_total = len(reviews)
+    if n_total > max_reviews:
+        reviews = reviews.sample(n=max_reviews, random_state=seed)
+        buckets = buckets.loc[reviews.index]
+
+    # Lowercased tokens of all reviews in one flat array
+    texts = reviews["title"].astype("str") + " " + reviews["review"].astype("str")
+    token_lists = texts.str.lower().str.findall(_TOKEN_PATTERN).reset_index(drop=True)
+    exploded = token_lists.explode().dropna()
+    tokens = exploded.to_numpy(dtype=object)
+    docs = exploded.index.to_numpy()
+    n_docs = len(reviews)
+
+    # Stopwords by document frequency over all buckets
+    token_codes, vocabulary = pd.factorize(tokens)
+    unigrams = sparse.csr_matrix(
+        (np.ones(len(tokens), dtype=np.int32), (docs, token_codes)),
+        shape=(n_docs, len(vocabulary)),
+    )
+    unigrams.sum_duplicates()
+    document_frequency = np.bincount(unigrams.indices, minlength=len(vocabulary))
+    stop_terms = (document_frequency > max(max_df * n_docs, 1)) | np.isin(
+        np.asarray(vocabulary, dtype=object), list(stopwords)
+    )
+    stop = stop_terms[token_codes]
+
+    # Reviews per bucket and term: (buckets x reviews) @ (reviews x terms)
+    bucket_codes, bucket_names = pd.factorize(buckets.to_numpy(), sort=True)
+    membership = sparse.csr_matrix(
+        (np.ones(n_docs, dtype=np.int32), (bucket_codes, np.arange(n_docs))),
+        shape=(len(bucket_names), n_docs),
+    )
+
+    rows = []
+    for n in range(1, max_n + 1):
+        matrix, terms = _ngram_matrix(tokens, docs, stop, n, n_docs)
+        counts = (membership @ matrix).tocsr()
+        for i, bucket in enumerate(bucket_names):
+            row = counts.getrow(i)
+            rows.append(
+                pd.DataFrame({"bucket": bucket, "term": terms[row.indices], "reviews": row.data})
+            )
+
+    ngrams = pd.concat(rows, ignore_index=True) if rows else pd.DataFrame(
+        columns=["bucket", "term", "reviews"]
+    )
+    ngrams = ngrams[ngrams["reviews"] >= min_count]
+    if n_total > n_docs:
+        ngrams = ngrams.assign(
+            reviews=(ngrams["reviews"] * n_total / n_docs).round().astype("int64")
+        )
+    return (
+        ngrams.sort_values(["bucket", "reviews", "term"], ascending=[True, False, True])
+        .groupby("bucket", sort=False)
+        .head(top_n)
+        .reset_index(drop=True)
+    )
+
+
+def wordcloud_png(
+    frequencies: dict,
+    width: int = 800,
+    height: int = 400,
+    colormap: str = "viridis",
+    cache_dir: str = os.path.join(DEFAULT_CACHE_DIR, "wordclouds"),
+    max_cache_bytes: int = 50 * 1024 * 1024,
+):
+    """Word cloud of term frequencies as PNG bytes (None if there are no
+    terms). Images are cached on disk by their inputs. Once the cached
+    images exceed `max_cache_bytes`, the least recently used are deleted."""
+    if len(frequencies) == 0:
+        return None
+
+    payload = json.dumps(
+        [sorted(frequencies.items()), width, height, colormap], default=int
+    )
+    path = os.path.join(cache_dir, hashlib.sha256(payload.encode("utf-8")).hexdigest() + ".png")
+    try:
+        with open(path, "rb") as f:
+            png = f.read()
+        # The modification time marks the last use for the eviction
+        os.utime(path)
+        return png
+    except FileNotFoundError:
+        pass
+
+    # Imported here, as it is only needed for uncached images
+    from wordcloud import WordCloud
+
+    image = (
+        WordCloud(
+            width=width,
+            height=height,
+            background_color="white",
+            colormap=colormap,
+            random_state=0,
+        )
+        .generate_from_frequencies(frequencies)
+        .to_image()
+    )
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    png = buffer.getvalue()
+
+    # Write atomically, concurrent sessions may create the same image
+    os.makedirs(cache_dir, exist_ok=True)
+    temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporary_path, "wb") as f:
+        f.write(png)
+    os.replace(temporary_path, path)
+    _evict_images(cache_dir, max_cache_bytes)
+    return png
+
+
+def _evict_images(cache_dir: str, max_bytes: int):
+    # Delete the least recently used images until the cache fits again
+    images = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith(".png"):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            images.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total_size = sum(size for _, size, _ in images)
+    for _, size, path in sorted(images):
+        if total_size <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # Deleted by a concurrent session
+            pass
+        total_size -= size
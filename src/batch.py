@@ -0,0 +1,376 @@
+import json
+import os
+import time
+import uuid
+
+import requests
+
+from src.cache import DEFAULT_CACHE_DIR
+from src.llm import DEFAULT_BASE_URL
+from src.utils import (
+    NEGATIVE_INSTRUCTION,
+    POSITIVE_INSTRUCTION,
+    RECOMMENDATIONS_SYSTEM_MESSAGE,
+    SUMMARY_SYSTEM_MESSAGE,
+    _cache_get,
+    _cache_key,
+    _cache_set,
+    _messages,
+    build_prompt,
+    build_recommendations_prompt,
+    count_tokens,
+    max_prompt_tokens,
+)
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+
+# Batch states after which no more results will arrive
+FINAL_STATES = ("completed", "failed", "expired", "cancelled")
+
+
+class BatchError(Exception):
+    pass
+
+
+def batch_request(custom_id: str, messages: list, model: str):
+    # One line of a batch input file
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": BATCH_ENDPOINT,
+        "body": {"model": model, "messages": messages},
+    }
+
+
+def write_batch_file(batch_requests: list, path: str):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        for request in batch_requests:
+            f.write(json.dumps(request, ensure_ascii=False) + "\n")
+    return path
+
+
+def parse_batch_results(lines):
+    """Map every custom_id of a batch output file to its response text
+    (or a BatchError if the request failed)."""
+    results = {}
+    for line in lines:
+        if not line.strip():
+            continue
+        result = json.loads(line)
+        response = result.get("response") or {}
+        if result.get("error") or response.get("status_code") != 200:
+            error = result.get("error") or (response.get("body") or {}).get("error")
+            results[result["custom_id"]] = BatchError(f"Request failed: {error}")
+        else:
+            results[result["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+    return results
+
+
+class OpenAIBatchBackend:
+    """Submits batch files to the OpenAI Batch API.
+
+    Requests go directly to the REST endpoints, as the pinned OpenAI client
+    predates the Batch API. `base_url` defaults to OPENAI_BASE_URL or the
+    official API.
+    """
+
+    # Real completions are shared with interactive analyses
+    use_completion_cache = True
+
+    def __init__(
+        self,
+        api_key: str = None,
+        base_url: str = None,
+        completion_window: str = "24h",
+        timeout: float = 60.0,
+    ):
+        self.api_key = api_key or os.environ.get("OPENAI_API_KEY")
+        if self.api_key is None:
+            raise ValueError("Please provide an OpenAI API key.")
+        self.base_url = (
+            base_url or os.environ.get("OPENAI_BASE_URL") or DEFAULT_BASE_URL
+        ).rstrip("/")
+        self.completion_window = completion_window
+        self.timeout = timeout
+        self._session = requests.Session()
+        self._session.headers["Authorization"] = f"Bearer {self.api_key}"
+
+    def _request(self, method: str, path: str, **kwargs):
+        response = self._session.request(
+            method, self.base_url + path, timeout=self.timeout, **kwargs
+        )
+        response.raise_for_status()
+        return response
+
+    def submit(self, path: str):
+        with open(path, "rb") as f:
+            input_file = self._request(
+                "POST",
+                "/files",
+                data={"purpose": "batch"},
+                files={"file": (os.path.basename(path), f, "application/jsonl")},
+            ).json()
+        batch = self._request(
+            "POST",
+            "/batches",
+            json={
+                "input_file_id": input_file["id"],
+                "endpoint": BATCH_ENDPOINT,
+                "completion_window": self.completion_window,
+            },
+        ).json()
+        return batch["id"]
+
+    def status(self, batch_id: str):
+        return self._request("GET", f"/batches/{batch_id}").json()["status"]
+
+    def results(self, batch_id: str):
+        batch = self._request("GET", f"/batches/{batch_id}").json()
+        lines = []
+        for file_id in [batch.get("output_file_id"), batch.get("error_file_id")]:
+            if file_id is not None:
+                lines += self._request("GET", f"/files/{file_id}/content").text.splitlines()
+        return parse_batch_results(lines)
+
+
+def _offline_response(body: dict):
+    # Placeholder answer of the local backend, so that bulk runs can be
+    # exercised without network access
+    return (
+        f"- **Offline batch result**: Generated locally by `{body['model']}` stand-in. "
+        "No API request was made."
+    )
+
+
+class LocalBatchBackend:
+    """File-based stand-in for the Batch API.
+
+    Batches are directories with the input file, their state and, once
+    complete, an output file in the Batch API's output format. A batch is
+    processed on the first status check at least `processing_delay`
+    seconds after submission. Every request is answered by
+    `respond(body)`, which returns the response text.
+    """
+
+    # Stand-in responses must never be served as real completions
+    use_completion_cache = False
+
+    def __init__(
+        self,
+        directory: str = os.path.join(DEFAULT_CACHE_DIR, "batches"),
+        respond=_offline_response,
+        processing_delay: float = 0.0,
+    ):
+        self.directory = directory
+        self.respond = respond
+        self.processing_delay = processing_delay
+
+    def _batch_dir(self, batch_id: str):
+        return os.path.join(self.directory, batch_id)
+
+    def _read_state(self, batch_id: str):
+        with open(os.path.join(self._batch_dir(batch_id), "state.json"), encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write_state(self, batch_id: str, state: dict):
+        with open(os.path.join(self._batch_dir(batch_id), "state.json"), "w", encoding="utf-8") as f:
+            json.dump(state, f)
+
+    def submit(self, path: str):
+        batch_id = f"batch_{uuid.uuid4().hex}"
+        os.makedirs(self._batch_dir(batch_id))
+        with open(path, encoding="utf-8") as source, open(
+            os.path.join(self._batch_dir(batch_id), "input.jsonl"), "w", encoding="utf-8"
+        ) as target:
+            target.write(source.read())
+        self._write_state(batch_id, {"status": "validating", "created_at": time.time()})
+        return batch_id
+
+    def _process(self, batch_id: str):
+        batch_dir = self._batch_dir(batch_id)
+        with open(os.path.join(batch_dir, "input.jsonl"), encoding="utf-8") as f:
+            batch_requests = [json.loads(line) for line in f if line.strip()]
+
+        with open(os.path.join(batch_dir, "output.jsonl"), "w", encoding="utf-8") as f:
+            for request in batch_requests:
+                content = self.respond(request["body"])
+                result = {
+                    "id": f"batch_req_{uuid.uuid4().hex}",
+                    "custom_id": request["custom_id"],
+                    "response": {
+                        "status_code": 200,
+                        "request_id": uuid.uuid4().hex,
+                        "body": {
+                            "object": "chat.completion",
+                            "model": request["body"]["model"],
+                            "choices": [
+                                {
+                                    "index": 0,
+                                    "message": {"role": "assistant", "content": content},
+                                    "finish_reason": "stop",
+                                }
+                            ],
+                        },
+                    },
+                    "error": None,
+                }
+                f.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+    def status(self, batch_id: str):
+        state = self._read_state(batch_id)
+        if state["status"] not in FINAL_STATES and (
+            time.time() - state["created_at"] >= self.processing_delay
+        ):
+            self._process(batch_id)
+            state["status"] = "completed"
+            self._write_state(batch_id, state)
+        return state["status"]
+
+    def results(self, batch_id: str):
+        with open(os.path.join(self._batch_dir(batch_id), "output.jsonl"), encoding="utf-8") as f:
+            return parse_batch_results(f)
+
+
+def run_batch(
+    batch_requests: list,
+    backend,
+    path: str,
+    poll_interval: float = 60.0,
+    timeout: float = None,
+    on_status=None,
+):
+    """Write the requests as a batch file, submit it and wait for the
+    results. Returns the response text (or a BatchError) per custom_id."""
+    if len(batch_requests) == 0:
+        return {}
+    write_batch_file(batch_requests, path)
+    batch_id = backend.submit(path)
+
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    while True:
+        status = backend.status(batch_id)
+        if on_status is not None:
+            on_status(batch_id, status)
+        if status in FINAL_STATES:
+            break
+        if deadline is not None and time.monotonic() > deadline:
+            raise TimeoutError(f"Batch {batch_id} did not complete within {timeout} seconds.")
+        time.sleep(poll_interval)
+
+    if status != "completed":
+        raise BatchError(f"Batch {batch_id} ended with status {status}.")
+    return backend.results(batch_id)
+
+
+def _summary_messages(reviews, instruction: str, model: str):
+    # The prompt of a single summary call, trimmed to the context window
+    token_budget = max_prompt_tokens(model) - count_tokens(instruction, model=model)
+    return _messages(
+        SUMMARY_SYSTEM_MESSAGE,
+        build_prompt(reviews, token_budget=token_budget, model=model) + instruction,
+    )
+
+
+def _run_cached_batch(messages_by_id: dict, model: str, backend, path: str, **kwargs):
+    # Requests answered by the completion cache are not sent again, and
+    # batch results are cached for later interactive analyses
+    cache_keys = {
+        custom_id: (
+            _cache_key(messages, model, backend.base_url) if backend.use_completion_cache else None
+        )
+        for custom_id, messages in messages_by_id.items()
+    }
+    results = {}
+    for custom_id, key in cache_keys.items():
+        cached_response = _cache_get(key)
+        if cached_response is not None:
+            results[custom_id] = cached_response
+
+    batch_results = run_batch(
+        [
+            batch_request(custom_id, messages, model)
+            for custom_id, messages in messages_by_id.items()
+            if custom_id not in results
+        ],
+        backend,
+        path,
+        **kwargs,
+    )
+    for custom_id, response in batch_results.items():
+        if not isinstance(response, BatchError):
+            _cache_set(cache_keys[custom_id], response)
+    results.update(batch_results)
+    return results
+
+
+def bulk_insights(
+    apps: dict,
+    backend,
+    model: str = "gpt-3.5-turbo",
+    work_dir: str = os.path.join(DEFAULT_CACHE_DIR, "bulk"),
+    poll_interval: float = 60.0,
+    timeout: float = None,
+    on_status=None,
+):
+    """Generate the insights of many apps with two batches.
+
+    `apps` maps an id of every app (e.g. its URL) to its name and its
+    positive and negative reviews, e.g. from `split_reviews` with
+    representative reviews, as every summary is a single request. The
+    first batch holds all summaries, the second all recommendations.
+    Returns (positive summary, negative summary, recommendations) per app
+    id; failed requests give a BatchError.
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    run_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    app_ids = list(apps)
+    batch_kwargs = dict(poll_interval=poll_interval, timeout=timeout, on_status=on_status)
+
+    # Batch 1: both summaries of every app (custom_id is "<app index>:<section>")
+    summary_messages = {}
+    for i, app_id in enumerate(app_ids):
+        _, positive_reviews, negative_reviews = apps[app_id]
+        for section, reviews, instruction in [
+            ("positive", positive_reviews, POSITIVE_INSTRUCTION),
+            ("negative", negative_reviews, NEGATIVE_INSTRUCTION),
+        ]:
+            if len(reviews) > 0:
+                summary_messages[f"{i}:{section}"] = _summary_messages(reviews, instruction, model)
+    summaries = _run_cached_batch(
+        summary_messages,
+        model,
+        backend,
+        os.path.join(work_dir, f"{run_id}-summaries.jsonl"),
+        **batch_kwargs,
+    )
+
+    # Batch 2: recommendations based on the summaries of every app
+    recommendation_messages = {}
+    for i, app_id in enumerate(app_ids):
+        app_summaries = [
+            summary
+            for summary in [summaries.get(f"{i}:positive"), summaries.get(f"{i}:negative")]
+            if isinstance(summary, str)
+        ]
+        if app_summaries:
+            recommendation_messages[f"{i}:recommendations"] = _messages(
+                RECOMMENDATIONS_SYSTEM_MESSAGE,
+                build_recommendations_prompt(app_summaries, apps[app_id][0]),
+            )
+    recommendations = _run_cached_batch(
+        recommendation_messages,
+        model,
+        backend,
+        os.path.join(work_dir, f"{run_id}-recommendations.jsonl"),
+        **batch_kwargs,
+    )
+
+    return {
+        app_id: (
+            summaries.get(f"{i}:positive"),
+            summaries.get(f"{i}:negative"),
+            recommendations.get(f"{i}:recommendations"),
+        )
+        for i, app_id in enumerate(app_ids)
+    }
@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from contextlib import closing
+
+DEFAULT_CACHE_DIR = os.environ.get("USER_REVIEWS_CACHE_DIR", ".cache")
+
+
+class CompletionCache:
+    """On-disk cache for LLM completions, keyed by a hash of the server's
+    base URL, the model and the messages.
+
+    Entries expire after `ttl_seconds`. Once the stored responses exceed
+    `max_size_bytes`, the least recently used entries are evicted.
+    """
+
+    def __init__(
+        self,
+        path: str = os.path.join(DEFAULT_CACHE_DIR, "completions.sqlite"),
+        max_size_bytes: int = 50 * 1024 * 1024,
+        ttl_seconds: int = 30 * 24 * 60 * 60,
+    ):
+        self.path = path
+        self.max_size_bytes = max_size_bytes
+        self.ttl_seconds = ttl_seconds
+        self._initialized = False
+
+    @staticmethod
+    def make_key(model: str, messages: list, base_url: str = None):
+        # Different servers may serve different models under the same name
+        payload = json.dumps(
+            {"base_url": base_url, "model": model, "messages": messages}, sort_keys=True
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _connect(self):
+        if not self._initialized:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+
+        # A fresh connection per operation keeps the cache usable from threads
+        conn = sqlite3.connect(self.path, timeout=30)
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS completions (
+                    key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+                """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_completions_accessed_at "
+                "ON completions (accessed_at)"
+            )
+            self._initialized = True
+        return conn
+
+    def get(self, key: str):
+        now = time.time()
+        try:
+            with closing(self._connect()) as conn, conn:
+                row = conn.execute(
+                    "SELECT response, created_at FROM completions WHERE key = ?",
+                    (key,),
+                ).fetchone()
+                if row is None:
+                    return None
+
+                response, created_at = row
+                if now - created_at > self.ttl_seconds:
+                    conn.execute("DELETE FROM completions WHERE key = ?", (key,))
+                    return None
+
+                conn.execute(
+                    "UPDATE completions SET accessed_at = ? WHERE key = ?", (now, key)
+                )
+                return response
+        except sqlite3.Error:
+            # A broken cache must never break the analysis itself
+            return None
+
+    def set(self, key: str, response: str):
+        now = time.time()
+        try:
+            with closing(self._connect()) as conn, conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?, ?)",
+                    (key, response, len(response.encode("utf-8")), now, now),
+                )
+                self._evict(conn, now)
+        except sqlite3.Error:
+            pass
+
+    def _evict(self, conn, now: float):
+        conn.execute(
+            "DELETE FROM completions WHERE created_at < ?", (now - self.ttl_seconds,)
+        )
+
+        (total_size,) = conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM completions"
+        ).fetchone()
+        if total_size <= self.max_size_bytes:
+            return
+
+        # Drop least recently used entries until the cache fits again
+        evicted_keys = []
+        for key, size in conn.execute(
+            "SELECT key, size FROM completions ORDER BY accessed_at ASC"
+        ):
+            if total_size <= self.max_size_bytes:
+                break
+            evicted_keys.append((key,))
+            total_size -= size
+        conn.executemany("DELETE FROM completions WHERE key = ?", evicted_keys)
+
+    def clear(self):
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM completions")
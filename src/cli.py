@@ -0,0 +1,329 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+from src.batch import LocalBatchBackend, OpenAIBatchBackend, bulk_insights
+from src.ingest import load_reviews
+from src.pipeline import scrape_and_summarize
+from src.review_store import ReviewStore
+from src.windows import WindowSummaryStore, generate_windowed_insights
+from src.utils import (
+    app_data_from_url,
+    app_store_reviews,
+    generate_insights,
+    split_reviews,
+    POSITIVE_INSTRUCTION,
+    NEGATIVE_INSTRUCTION,
+)
+
+
+def _is_url(source: str):
+    return re.match(r"https?://", source) is not None
+
+
+def load_source(source: str, options: dict):
+    # Returns the reviews and a display name for an App Store URL or a file
+    if _is_url(source):
+        reviews = app_store_reviews(
+            source,
+            n_last_reviews=options["n_last_reviews"],
+            start_date=options["start_date"],
+            end_date=options["end_date"],
+            store=ReviewStore(),
+            timeout=options["timeout"],
+            return_partial=True,
+        )
+        _, app_name, _ = app_data_from_url(source)
+    else:
+        # The format is detected from the file name, a path has no name attribute
+        reviews, _ = load_reviews(source, name=source, max_reviews=options["max_file_reviews"])
+        app_name = re.sub(r"(\.csv\.gz|\.csv|\.parquet)$", "", os.path.basename(source))
+    return reviews, app_name
+
+
+def prepare_source(source: str, options: dict):
+    # Reviews of one source, split for a single summary request per sentiment
+    reviews, app_name = load_source(source, options)
+    if len(reviews) == 0:
+        raise ValueError(f"No reviews were found for {source}.")
+    positive_reviews, negative_reviews = split_reviews(
+        reviews,
+        merge_duplicates=options["merge_duplicates"],
+        max_representative_reviews=options["representative_reviews"],
+    )
+    return app_name, reviews, positive_reviews, negative_reviews
+
+
+def generate_source_insights(reviews, app_name: str, options: dict):
+    if options["by_week"]:
+        # Weeks summarized in earlier runs are reused from the store
+        positive_summary, negative_summary, recommendations, _ = generate_windowed_insights(
+            reviews,
+            app_name,
+            api_key=options["api_key"],
+            model=options["model"],
+            store=WindowSummaryStore(),
+            merge_duplicates=options["merge_duplicates"],
+        )
+        return positive_summary, negative_summary, recommendations
+
+    positive_reviews, negative_reviews = split_reviews(
+        reviews,
+        merge_duplicates=options["merge_duplicates"],
+        max_representative_reviews=options["representative_reviews"],
+    )
+    return generate_insights(
+        positive_reviews=positive_reviews,
+        negative_reviews=negative_reviews,
+        app_name=app_name,
+        positive_instruction=POSITIVE_INSTRUCTION,
+        negative_instruction=NEGATIVE_INSTRUCTION,
+        api_key=options["api_key"],
+        model=options["model"],
+    )
+
+
+def analyze_source(source: str, options: dict):
+    if options["pipeline"] and _is_url(source):
+        # Summarize early pages of reviews while later pages are scraped
+        reviews, positive_summary, negative_summary, recommendations = scrape_and_summarize(
+            source,
+            n_last_reviews=options["n_last_reviews"],
+            start_date=options["start_date"],
+            end_date=options["end_date"],
+            timeout=options["timeout"],
+            api_key=options["api_key"],
+            model=options["model"],
+            merge_duplicates=options["merge_duplicates"],
+        )
+        _, app_name, _ = app_data_from_url(source)
+    else:
+        reviews, app_name = load_source(source, options)
+        if len(reviews) == 0:
+            raise ValueError(f"No reviews were found for {source}.")
+        positive_summary, negative_summary, recommendations = generate_source_insights(
+            reviews, app_name, options
+        )
+
+    return make_report(
+        source, app_name, options, reviews, positive_summary, negative_summary, recommendations
+    )
+
+
+def make_report(
+    source: str,
+    app_name: str,
+    options: dict,
+    reviews,
+    positive_summary: str,
+    negative_summary: str,
+    recommendations: str,
+):
+    return {
+        "source": source,
+        "app_name": app_name,
+        "model": options["model"],
+        "n_reviews": len(reviews),
+        "share_positive": float((reviews["rating"] > 3).mean()),
+        "positive_summary": positive_summary,
+        "negative_summary": negative_summary,
+        "recommendations": recommendations,
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+    }
+
+
+def report_markdown(report: dict):
+    sections = [
+        f"# {report['app_name']}",
+        f"{report['n_reviews']} reviews from `{report['source']}`, "
+        f"{round(report['share_positive'] * 100)}% positive. "
+        f"Generated with `{report['model']}` at {report['generated_at']}.",
+    ]
+    for title, key in [
+        ("🤩 Highlights", "positive_summary"),
+        ("🤔 Problems", "negative_summary"),
+        ("🧭 Recommended improvements", "recommendations"),
+    ]:
+        sections.append(f"## {title}")
+        sections.append(report[key] or "No reviews were found for this section.")
+    return "\n\n".join(sections) + "\n"
+
+
+def write_report(report: dict, output_dir: str, formats: list):
+    # The same app can be listed for several countries (or as several files),
+    # a short hash of the source keeps their reports apart
+    slug = re.sub(r"[^a-z0-9]+", "-", report["app_name"].lower()).strip("-")
+    slug += "-" + hashlib.sha1(report["source"].encode("utf-8")).hexdigest()[:8]
+    paths = []
+    if "json" in formats:
+        paths.append(os.path.join(output_dir, f"{slug}.json"))
+        with open(paths[-1], "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if "md" in formats:
+        paths.append(os.path.join(output_dir, f"{slug}.md"))
+        with open(paths[-1], "w", encoding="utf-8") as f:
+            f.write(report_markdown(report))
+    return paths
+
+
+def parse_args(argv=None):
+    today = datetime.now()
+    parser = argparse.ArgumentParser(
+        description="Summarize App Store reviews for many apps without the Streamlit UI."
+    )
+    parser.add_argument(
+        "inputs",
+        help="Text file with one App Store URL or review file (.csv, .csv.gz, .parquet) per line",
+    )
+    parser.add_argument("--output-dir", default="reports")
+    parser.add_argument("--format", choices=["json", "md", "both"], default="both")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="Number of apps analyzed in parallel (each worker has its own scraping rate limit)",
+    )
+    parser.add_argument(
+        "--model", choices=["gpt-3.5-turbo", "gpt-4-0125-preview"], default="gpt-3.5-turbo"
+    )
+    parser.add_argument(
+        "--api-key",
+        default=os.environ.get("OPENAI_API_KEY"),
+        help="OpenAI API key (defaults to the OPENAI_API_KEY environment variable)",
+    )
+    parser.add_argument(
+        "--start-date", default=(today - timedelta(days=7)).strftime("%Y-%m-%d")
+    )
+    parser.add_argument("--end-date", default=today.strftime("%Y-%m-%d"))
+    parser.add_argument("--n-last-reviews", type=int, default=100)
+    parser.add_argument("--timeout", type=int, default=60)
+    parser.add_argument("--max-file-reviews", type=int, default=100_000)
+    parser.add_argument("--representative-reviews", type=int, default=300)
+    parser.add_argument("--no-merge-duplicates", action="store_true")
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="Summarize App Store reviews while later pages are still scraped "
+        "(bypasses the local review store and the selection of representative reviews)",
+    )
+    parser.add_argument(
+        "--batch",
+        choices=["openai", "local"],
+        help="Send all requests as two batches through the OpenAI Batch API (cheaper, but "
+        "may take up to 24 hours) or through a local file-based stand-in without network access",
+    )
+    parser.add_argument("--batch-dir", default=os.path.join(".cache", "bulk"))
+    parser.add_argument(
+        "--poll-interval", type=float, default=60, help="Seconds between batch status checks"
+    )
+    parser.add_argument(
+        "--by-week",
+        action="store_true",
+        help="Compose the summaries from weekly summaries, reusing weeks summarized in earlier runs",
+    )
+    return parser.parse_args(argv)
+
+
+def run_bulk(sources: list, options: dict, args, formats: list):
+    # Load all sources in parallel, then summarize them in batches
+    apps = {}
+    n_failed = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = {
+            executor.submit(prepare_source, source, options): source for source in sources
+        }
+        for future in as_completed(futures):
+            source = futures[future]
+            try:
+                apps[source] = future.result()
+            except Exception as e:
+                n_failed += 1
+                print(f"FAILED {source}: {e}", file=sys.stderr)
+
+    if args.batch == "openai":
+        backend = OpenAIBatchBackend(api_key=options["api_key"])
+    else:
+        backend = LocalBatchBackend(directory=os.path.join(args.batch_dir, "local"))
+
+    insights = bulk_insights(
+        {
+            source: (app_name, positive_reviews, negative_reviews)
+            for source, (app_name, _, positive_reviews, negative_reviews) in apps.items()
+        },
+        backend,
+        model=options["model"],
+        work_dir=args.batch_dir,
+        poll_interval=args.poll_interval,
+        on_status=lambda batch_id, status: print(f"Batch {batch_id}: {status}"),
+    )
+
+    for source, (app_name, reviews, _, _) in apps.items():
+        results = insights[source]
+        errors = [result for result in results if isinstance(result, Exception)]
+        if errors:
+            n_failed += 1
+            print(f"FAILED {source}: {errors[0]}", file=sys.stderr)
+            continue
+        report = make_report(source, app_name, options, reviews, *results)
+        for path in write_report(report, args.output_dir, formats):
+            print(f"Wrote {path}")
+
+    print(f"{len(sources) - n_failed} of {len(sources)} analyses succeeded.")
+    return 1 if n_failed else 0
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    with open(args.inputs, encoding="utf-8") as f:
+        sources = [
+            line.strip() for line in f if line.strip() and not line.startswith("#")
+        ]
+
+    options = {
+        "model": args.model,
+        "api_key": args.api_key,
+        "start_date": args.start_date,
+        "end_date": args.end_date,
+        "n_last_reviews": args.n_last_reviews,
+        "timeout": args.timeout,
+        "max_file_reviews": args.max_file_reviews,
+        "representative_reviews": args.representative_reviews,
+        "merge_duplicates": not args.no_merge_duplicates,
+        "by_week": args.by_week,
+        "pipeline": args.pipeline,
+    }
+    formats = ["json", "md"] if args.format == "both" else [args.format]
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    if args.batch is not None:
+        return run_bulk(sources, options, args, formats)
+
+    n_failed = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = {
+            executor.submit(analyze_source, source, options): source
+            for source in sources
+        }
+        for future in as_completed(futures):
+            source = futures[future]
+            try:
+                report = future.result()
+            except Exception as e:
+                n_failed += 1
+                print(f"FAILED {source}: {e}", file=sys.stderr)
+                continue
+            for path in write_report(report, args.output_dir, formats):
+                print(f"Wrote {path}")
+
+    print(f"{len(sources) - n_failed} of {len(sources)} analyses succeeded.")
+    return 1 if n_failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
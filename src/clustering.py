@@ -0,0 +1,114 @@
+import re
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+_TOKEN_PATTERN = re.compile(r"\w\w+")
+
+
+def tfidf_matrix(texts, min_df: int = 2, max_df: float = 0.5, max_features: int = 20000):
+    # Sparse term counts per document
+    vocabulary = {}
+    indices = []
+    indptr = [0]
+    for text in texts:
+        for token in _TOKEN_PATTERN.findall(str(text).lower()):
+            indices.append(vocabulary.setdefault(token, len(vocabulary)))
+        indptr.append(len(indices))
+    counts = sparse.csr_matrix(
+        (np.ones(len(indices)), np.array(indices, dtype=np.int64), np.array(indptr)),
+        shape=(len(texts), len(vocabulary)),
+    )
+    counts.sum_duplicates()
+
+    # Keep informative terms only: not too rare and not too common
+    n_docs = counts.shape[0]
+    document_frequency = np.bincount(counts.indices, minlength=counts.shape[1])
+    keep = (document_frequency >= min(min_df, n_docs)) & (
+        document_frequency <= max(max_df * n_docs, 1)
+    )
+    keep_indices = np.flatnonzero(keep)
+    if len(keep_indices) > max_features:
+        top = np.argsort(document_frequency[keep_indices])[::-1][:max_features]
+        keep_indices = np.sort(keep_indices[top])
+    counts = counts[:, keep_indices]
+    document_frequency = document_frequency[keep_indices]
+
+    # TF-IDF weighting with L2-normalized rows (so dot products are cosines)
+    idf = np.log((1 + n_docs) / (1 + document_frequency)) + 1
+    tfidf = counts.multiply(idf).tocsr()
+    norms = np.sqrt(np.asarray(tfidf.multiply(tfidf).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sparse.diags(1 / norms) @ tfidf
+
+
+def spherical_kmeans(X, n_clusters: int, max_iter: int = 30, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    n_docs = X.shape[0]
+    centroids = X[rng.choice(n_docs, size=n_clusters, replace=False)].toarray()
+
+    labels = None
+    for _ in range(max_iter):
+        new_labels = np.asarray((X @ centroids.T).argmax(axis=1)).ravel()
+        if labels is not None and np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+
+        # Recompute centroids as normalized sums of their members
+        membership = sparse.csr_matrix(
+            (np.ones(n_docs), (labels, np.arange(n_docs))),
+            shape=(n_clusters, n_docs),
+        )
+        sums = np.asarray((membership @ X).todense())
+        norms = np.linalg.norm(sums, axis=1)
+        non_empty = norms > 0
+        centroids[non_empty] = sums[non_empty] / norms[non_empty, None]
+
+    return labels, centroids
+
+
+def representative_reviews(
+    reviews: pd.DataFrame,
+    max_reviews: int = 300,
+    n_clusters: int = None,
+    seed: int = 0,
+):
+    """Select the most central reviews of each topic cluster.
+
+    Reviews are clustered by the TF-IDF vectors of their title and text.
+    Each cluster contributes reviews in proportion to its size, and the
+    returned reviews carry `cluster` and `cluster_size` columns.
+    """
+    if len(reviews) <= max_reviews:
+        return reviews
+
+    texts = reviews["title"].astype("str") + " " + reviews["review"].astype("str")
+    X = tfidf_matrix(texts.tolist())
+
+    if n_clusters is None:
+        n_clusters = int(np.clip(np.sqrt(len(reviews) / 2), 2, 20))
+    n_clusters = min(n_clusters, len(reviews))
+    labels, centroids = spherical_kmeans(X, n_clusters, seed=seed)
+    similarities = np.asarray(X @ centroids.T)
+    centrality = similarities[np.arange(len(reviews)), labels]
+
+    # Merged near-duplicates count as several reviews
+    if "duplicate_count" in reviews.columns:
+        weights = reviews["duplicate_count"].to_numpy()
+    else:
+        weights = np.ones(len(reviews), dtype=np.int64)
+    cluster_sizes = np.bincount(labels, weights=weights, minlength=n_clusters)
+
+    selected = []
+    for cluster in np.flatnonzero(cluster_sizes):
+        members = np.flatnonzero(labels == cluster)
+        n_selected = max(1, int(round(max_reviews * cluster_sizes[cluster] / weights.sum())))
+        most_central = members[np.argsort(centrality[members])[::-1][:n_selected]]
+        selected.extend(most_central)
+
+    selected = np.array(selected)
+    representatives = reviews.iloc[selected].copy()
+    representatives["cluster"] = labels[selected]
+    representatives["cluster_size"] = cluster_sizes[labels[selected]].astype(np.int64)
+    return representatives
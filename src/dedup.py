@@ -0,0 +1,141 @@
+import numpy as np
+import pandas as pd
+
+# Odd 64-bit constants for hashing (products wrap around modulo 2**64)
+_SHINGLE_BASE = np.uint64(0x100000001B3)
+_MIX_1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX_2 = np.uint64(0x94D049BB133111EB)
+
+# Texts hashed at once (keeps the flat shingle arrays small enough for the CPU cache)
+_BATCH_SIZE = 2_000
+
+
+def _mix(hashes: np.ndarray):
+    # Spread every input bit over all output bits (splitmix64 finalizer)
+    hashes = hashes ^ (hashes >> np.uint64(30))
+    hashes = hashes * _MIX_1
+    hashes = hashes ^ (hashes >> np.uint64(27))
+    hashes = hashes * _MIX_2
+    return hashes ^ (hashes >> np.uint64(31))
+
+
+def _shingle_hashes(texts, k: int = 5):
+    # 32-bit hashes of the character k-grams of all normalized texts in one
+    # flat array, with the position of the first hash of every text. Short
+    # texts are padded to k characters, so they are a single shingle.
+    texts = [" ".join(str(text).lower().split()).ljust(k, "\0") for text in texts]
+    lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+    code_points = np.frombuffer("".join(texts).encode("utf-32-le"), dtype=np.uint32)
+
+    # Hash the k-grams at every position of the joined texts, then keep
+    # those that start and end within the same text
+    n_positions = len(code_points) - k + 1
+    hashes = np.zeros(n_positions, dtype=np.uint64)
+    for offset in range(k):
+        hashes *= _SHINGLE_BASE
+        hashes += code_points[offset : offset + n_positions]
+    n_shingles = lengths - k + 1
+    text_starts = np.cumsum(lengths) - lengths
+    first_shingles = np.cumsum(n_shingles) - n_shingles
+    positions = np.repeat(text_starts - first_shingles, n_shingles) + np.arange(n_shingles.sum())
+    hashes = _mix(hashes[positions])
+    return (hashes >> np.uint64(32)).astype(np.uint32), first_shingles
+
+
+def minhash_signatures(texts, num_perm: int = 64, k: int = 5, seed: int = 0):
+    # Every permutation maps a shingle hash x to a * x + b (modulo 2**32,
+    # a bijection for odd a); the signature holds the minimum per text
+    rng = np.random.default_rng(seed)
+    a = rng.integers(0, 2**32, size=num_perm, dtype=np.uint64).astype(np.uint32) | np.uint32(1)
+    b = rng.integers(0, 2**32, size=num_perm, dtype=np.uint64).astype(np.uint32)
+
+    texts = list(texts)
+    signatures = np.empty((len(texts), num_perm), dtype=np.uint32)
+    for start in range(0, len(texts), _BATCH_SIZE):
+        hashes, first_shingles = _shingle_hashes(texts[start : start + _BATCH_SIZE], k=k)
+        permuted = np.empty_like(hashes)
+        for i in range(num_perm):
+            np.multiply(hashes, a[i], out=permuted)
+            np.add(permuted, b[i], out=permuted)
+            signatures[start : start + len(first_shingles), i] = np.minimum.reduceat(
+                permuted, first_shingles
+            )
+    return signatures
+
+
+def lsh_candidate_pairs(signatures: np.ndarray, bands: int = 16):
+    # Reviews that agree on all rows of at least one band become candidates
+    # (paired with the first review of their bucket). Returns an array of
+    # unique (i, j) pairs.
+    rows_per_band = signatures.shape[1] // bands
+    row_weights = _mix(np.arange(1, rows_per_band + 1, dtype=np.uint64)) | np.uint64(1)
+    n = len(signatures)
+    indices = np.arange(n, dtype=np.int64)
+    pairs = [np.empty(0, dtype=np.int64)]
+    for band in range(bands):
+        band_rows = signatures[:, band * rows_per_band : (band + 1) * rows_per_band]
+        # Colliding band keys only add candidates, which are verified later
+        band_keys = (_mix(band_rows.astype(np.uint64)) * row_weights).sum(axis=1)
+        _, first_members, buckets = np.unique(band_keys, return_index=True, return_inverse=True)
+        representatives = first_members[buckets.ravel()]
+        members = representatives != indices
+        # Encode every pair as a single integer, unique on them is much faster
+        pairs.append(representatives[members] * n + indices[members])
+    pairs = np.unique(np.concatenate(pairs))
+    return np.column_stack([pairs // n, pairs % n])
+
+
+def collapse_near_duplicates(
+    reviews: pd.DataFrame,
+    threshold: float = 0.8,
+    num_perm: int = 64,
+    bands: int = 16,
+):
+    """Collapse near-duplicate reviews into one representative each.
+
+    Reviews with the same rating whose estimated Jaccard similarity (on
+    character shingles of title and text) reaches `threshold` are merged.
+    The first review of each group is kept, and the size of the group is
+    stored in a `duplicate_count` column.
+    """
+    if len(reviews) == 0:
+        return reviews.assign(duplicate_count=pd.Series(dtype="int64"))
+
+    texts = (reviews["title"].astype("str") + " " + reviews["review"].astype("str")).tolist()
+    ratings = reviews["rating"].to_numpy()
+    signatures = minhash_signatures(texts, num_perm=num_perm)
+
+    # Verify all candidate pairs at once
+    pairs = lsh_candidate_pairs(signatures, bands=bands)
+    first, second = pairs[:, 0], pairs[:, 1]
+    similar = (ratings[first] == ratings[second]) & (
+        (signatures[first] == signatures[second]).mean(axis=1) >= threshold
+    )
+
+    # Union-find over the verified pairs (every parent is a smaller index)
+    parent = list(range(len(reviews)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, j in zip(first[similar].tolist(), second[similar].tolist()):
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    # Follow the parents of all reviews at once until every review points to its root
+    roots = np.array(parent)
+    while True:
+        next_roots = roots[roots]
+        if np.array_equal(next_roots, roots):
+            break
+        roots = next_roots
+    representatives = np.unique(roots)
+    counts = np.bincount(roots, minlength=len(reviews))[representatives]
+
+    collapsed = reviews.iloc[representatives].copy()
+    collapsed["duplicate_count"] = counts
+    return collapsed
@@ -0,0 +1,148 @@
+import numpy as np
+import pandas as pd
+
+REQUIRED_COLUMNS = ["title", "review", "rating"]
+OPTIONAL_COLUMNS = ["date"]
+
+
+class _Reservoir:
+    # Uniform sample of fixed size over a stream of rows (algorithm R),
+    # applied to whole chunks at once
+
+    def __init__(self, size: int, rng: np.random.Generator):
+        self.size = size
+        self.rng = rng
+        self.n_seen = 0
+        self.rows = None
+
+    def add(self, chunk: pd.DataFrame):
+        chunk = chunk.reset_index(drop=True)
+        if self.rows is None:
+            self.rows = chunk.iloc[:0]
+
+        # Fill the reservoir first
+        n_free = max(self.size - len(self.rows), 0)
+        if n_free > 0:
+            self.rows = pd.concat([self.rows, chunk.iloc[:n_free]], ignore_index=True)
+            self.n_seen += min(n_free, len(chunk))
+            chunk = chunk.iloc[n_free:]
+        if len(chunk) == 0:
+            return
+
+        # Row t replaces a random slot with probability size / (t + 1);
+        # for slots hit several times, the last row wins as in the sequential algorithm
+        stream_positions = self.n_seen + np.arange(len(chunk))
+        slots = (self.rng.random(len(chunk)) * (stream_positions + 1)).astype(np.int64)
+        candidates = np.flatnonzero(slots < self.size)[::-1]
+        _, last_hits = np.unique(slots[candidates], return_index=True)
+        candidates = candidates[last_hits]
+
+        for column in self.rows.columns:
+            values = self.rows[column].to_numpy(copy=True)
+            values[slots[candidates]] = chunk[column].to_numpy()[candidates]
+            self.rows[column] = pd.Series(values, dtype=self.rows[column].dtype)
+        self.n_seen += len(chunk)
+
+
+def _file_format(name: str):
+    name = (name or "").lower()
+    if name.endswith(".parquet") or name.endswith(".pq"):
+        return "parquet"
+    if name.endswith(".gz"):
+        return "csv.gz"
+    return "csv"
+
+
+def _validate_columns(columns):
+    if not all(col in columns for col in REQUIRED_COLUMNS):
+        raise ValueError(
+            'The uploaded file does not contain the required columns "title", "review", and "rating".'
+        )
+    return REQUIRED_COLUMNS + [col for col in OPTIONAL_COLUMNS if col in columns]
+
+
+def _iter_chunks(file, file_format: str, chunksize: int):
+    if file_format == "parquet":
+        import pyarrow.parquet as pq
+
+        parquet_file = pq.ParquetFile(file)
+        usecols = _validate_columns(parquet_file.schema_arrow.names)
+        for batch in parquet_file.iter_batches(batch_size=chunksize, columns=usecols):
+            yield batch.to_pandas()
+        return
+
+    # Validate the header before reading any rows
+    compression = "gzip" if file_format == "csv.gz" else None
+    header = pd.read_csv(file, nrows=0, compression=compression)
+    usecols = _validate_columns(header.columns)
+    if hasattr(file, "seek"):
+        file.seek(0)
+
+    yield from pd.read_csv(
+        file,
+        usecols=usecols,
+        dtype={"title": "string", "review": "string"},
+        compression=compression,
+        chunksize=chunksize,
+    )
+
+
+def _clean_chunk(chunk: pd.DataFrame):
+    chunk = chunk.assign(rating=pd.to_numeric(chunk["rating"], errors="coerce"))
+    chunk = chunk[chunk["rating"].between(1, 5)]
+    chunk = chunk.assign(
+        rating=chunk["rating"].astype("int8"),
+        title=chunk["title"].fillna(""),
+        review=chunk["review"].fillna(""),
+    )
+    if "date" in chunk.columns:
+        chunk = chunk.assign(date=pd.to_datetime(chunk["date"], errors="coerce"))
+    return chunk
+
+
+def load_reviews(
+    file,
+    name: str = None,
+    max_reviews: int = None,
+    stratify_by_rating: bool = True,
+    chunksize: int = 50_000,
+    seed: int = 0,
+):
+    """Load reviews from a CSV, gzipped CSV or Parquet file in chunks.
+
+    Only the review columns are read. If `max_reviews` is given, a uniform
+    sample of that size is drawn while reading (per rating if
+    `stratify_by_rating`, in proportion to each rating's share). Returns the
+    reviews and the number of valid reviews in the file.
+    """
+    file_format = _file_format(name or getattr(file, "name", None))
+    rng = np.random.default_rng(seed)
+
+    if max_reviews is None:
+        chunks = [_clean_chunk(chunk) for chunk in _iter_chunks(file, file_format, chunksize)]
+        if len(chunks) == 0:
+            return pd.DataFrame(columns=REQUIRED_COLUMNS), 0
+        reviews = pd.concat(chunks, ignore_index=True)
+        return reviews, len(reviews)
+
+    # One reservoir per rating (each large enough for the final allocation)
+    reservoirs = {}
+    for chunk in _iter_chunks(file, file_format, chunksize):
+        chunk = _clean_chunk(chunk)
+        groups = chunk.groupby("rating") if stratify_by_rating else [(None, chunk)]
+        for rating, group in groups:
+            if rating not in reservoirs:
+                reservoirs[rating] = _Reservoir(max_reviews, rng)
+            reservoirs[rating].add(group)
+
+    n_total = sum(reservoir.n_seen for reservoir in reservoirs.values())
+    if n_total == 0:
+        return pd.DataFrame(columns=REQUIRED_COLUMNS), 0
+
+    # Allocate the sample to ratings in proportion to their counts
+    samples = []
+    for reservoir in reservoirs.values():
+        n_sample = min(len(reservoir.rows), round(max_reviews * reservoir.n_seen / n_total))
+        samples.append(reservoir.rows.sample(n=n_sample, random_state=seed))
+    reviews = pd.concat(samples, ignore_index=True)
+    return reviews, n_total
@@ -0,0 +1,152 @@
+import functools
+import json
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger("user_reviews.metrics")
+
+
+class Metrics:
+    """Process-wide timings and token usage of the pipeline stages.
+
+    Every finished stage is kept as an event (the most recent `max_events`)
+    and logged as one JSON line to the `user_reviews.metrics` logger.
+    Aggregates can be exported in the Prometheus text format.
+    """
+
+    def __init__(self, max_events: int = 10_000):
+        self._events = deque(maxlen=max_events)
+        self._totals = {}
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str, **fields):
+        # Callers can add fields (e.g. review counts) to the yielded dict
+        event = {"stage": name, **fields}
+        start = time.perf_counter()
+        try:
+            yield event
+        except BaseException:
+            event["error"] = True
+            raise
+        finally:
+            event["seconds"] = time.perf_counter() - start
+            event["timestamp"] = time.time()
+            self._record(event)
+
+    def timed(self, name: str, count_first_arg: bool = False):
+        # Decorator version of stage(); optionally records len() of the
+        # first argument (e.g. a reviews DataFrame) as the review count
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                fields = {}
+                if count_first_arg and args:
+                    fields["reviews"] = len(args[0])
+                with self.stage(name, **fields):
+                    return fn(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def _record(self, event: dict):
+        with self._lock:
+            self._events.append(event)
+            totals = self._totals.setdefault(
+                event["stage"], {"calls": 0, "seconds": 0.0, "reviews": 0, "errors": 0}
+            )
+            totals["calls"] += 1
+            totals["seconds"] += event["seconds"]
+            totals["reviews"] += event.get("reviews", 0)
+            totals["errors"] += int(event.get("error", False))
+
+            if "prompt_tokens" in event:
+                tokens = self._tokens.setdefault(
+                    event.get("model", "unknown"), {"prompt": 0, "completion": 0}
+                )
+                tokens["prompt"] += event["prompt_tokens"]
+                tokens["completion"] += event["completion_tokens"]
+
+        logger.info(json.dumps(event, default=str))
+
+    def events(self):
+        with self._lock:
+            return list(self._events)
+
+    def summary(self):
+        with self._lock:
+            return {stage: dict(totals) for stage, totals in self._totals.items()}
+
+    def token_usage(self):
+        with self._lock:
+            return {model: dict(tokens) for model, tokens in self._tokens.items()}
+
+    def prometheus_text(self):
+        lines = [
+            "# HELP user_reviews_stage_seconds_total Wall time spent per pipeline stage.",
+            "# TYPE user_reviews_stage_seconds_total counter",
+        ]
+        summary = self.summary()
+        for stage, totals in summary.items():
+            lines.append(f'user_reviews_stage_seconds_total{{stage="{stage}"}} {totals["seconds"]}')
+        lines += [
+            "# HELP user_reviews_stage_calls_total Number of runs per pipeline stage.",
+            "# TYPE user_reviews_stage_calls_total counter",
+        ]
+        for stage, totals in summary.items():
+            lines.append(f'user_reviews_stage_calls_total{{stage="{stage}"}} {totals["calls"]}')
+        lines += [
+            "# HELP user_reviews_stage_errors_total Number of failed runs per pipeline stage.",
+            "# TYPE user_reviews_stage_errors_total counter",
+        ]
+        for stage, totals in summary.items():
+            lines.append(f'user_reviews_stage_errors_total{{stage="{stage}"}} {totals["errors"]}')
+        lines += [
+            "# HELP user_reviews_reviews_processed_total Number of reviews processed per pipeline stage.",
+            "# TYPE user_reviews_reviews_processed_total counter",
+        ]
+        for stage, totals in summary.items():
+            lines.append(f'user_reviews_reviews_processed_total{{stage="{stage}"}} {totals["reviews"]}')
+        lines += [
+            "# HELP user_reviews_llm_tokens_total Tokens used by LLM calls.",
+            "# TYPE user_reviews_llm_tokens_total counter",
+        ]
+        for model, tokens in self.token_usage().items():
+            for kind, count in tokens.items():
+                lines.append(
+                    f'user_reviews_llm_tokens_total{{model="{model}",kind="{kind}"}} {count}'
+                )
+        return "\n".join(lines) + "\n"
+
+
+# Metrics shared by the whole process
+metrics = Metrics()
+
+
+def start_prometheus_server(port: int = 9100, registry: Metrics = metrics):
+    """Serve `registry` in the Prometheus text format at /metrics."""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            payload = registry.prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,154 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Job:
+    """A unit of background work with progress reporting and cancellation."""
+
+    def __init__(self, job_id: str, key=None):
+        self.id = job_id
+        self.key = key
+        self.status = "pending"
+        self.progress = 0.0
+        self.message = ""
+        self.result = None
+        self.error = None
+        # Set by jobs that stopped early and returned an incomplete result
+        self.partial = False
+        self.created_at = time.time()
+        self.accessed_at = self.created_at
+        self.finished_at = None
+        self.stop_event = threading.Event()
+        self.cancel_requested = False
+        # Text produced piece by piece (e.g. streamed completions) and token
+        # usage by stream name, so that pages can attach to a running job
+        self.streams = {}
+        self.usage = {}
+        self._closed_streams = set()
+        self._streams_lock = threading.Lock()
+        self._done = threading.Event()
+
+    def update(self, progress: float = None, message: str = None):
+        if progress is not None:
+            self.progress = progress
+        if message is not None:
+            self.message = message
+
+    def append(self, stream: str, text: str):
+        with self._streams_lock:
+            self.streams[stream] = self.streams.get(stream, "") + text
+
+    def close_stream(self, stream: str):
+        with self._streams_lock:
+            self._closed_streams.add(stream)
+
+    def follow(self, stream: str, poll_interval: float = 0.1):
+        # Yield the text of a stream as it is produced, starting with the
+        # text buffered so far, until the stream is closed or the job ends
+        position = 0
+        while True:
+            with self._streams_lock:
+                finished = stream in self._closed_streams or self.done()
+                text = self.streams.get(stream, "")
+            if len(text) > position:
+                yield text[position:]
+                position = len(text)
+            elif finished:
+                return
+            else:
+                time.sleep(poll_interval)
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout: float = None):
+        return self._done.wait(timeout)
+
+
+class JobManager:
+    """Runs jobs on a shared worker pool and keeps their state by job id.
+
+    Jobs submitted with a `key` are deduplicated: while a job with the same
+    key is pending, running or finished successfully with a complete result,
+    its id is returned instead of starting the work again. Finished jobs are
+    forgotten after `ttl_seconds`, and beyond `max_finished_jobs` the least
+    recently used finished jobs are forgotten (together with their results).
+    """
+
+    def __init__(
+        self, max_workers: int = 4, ttl_seconds: int = 60 * 60, max_finished_jobs: int = 100
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_finished_jobs = max_finished_jobs
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._jobs = {}
+        self._jobs_by_key = {}
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, key=None, **kwargs):
+        with self._lock:
+            self._remove_expired()
+
+            if key is not None and key in self._jobs_by_key:
+                job = self._jobs[self._jobs_by_key[key]]
+                if job.status in ("pending", "running") or (
+                    job.status == "done" and not job.partial
+                ):
+                    job.accessed_at = time.time()
+                    return job.id
+
+            job = Job(uuid.uuid4().hex, key=key)
+            self._jobs[job.id] = job
+            if key is not None:
+                self._jobs_by_key[key] = job.id
+
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job.id
+
+    def _run(self, job: Job, fn, args, kwargs):
+        if job.cancel_requested:
+            job.status = "cancelled"
+        else:
+            job.status = "running"
+            try:
+                job.result = fn(job, *args, **kwargs)
+                job.status = "cancelled" if job.cancel_requested else "done"
+                job.progress = 1.0
+            except Exception as e:
+                job.error = e
+                job.status = "failed"
+        job.finished_at = time.time()
+        job._done.set()
+        with self._lock:
+            self._remove_expired()
+
+    def get(self, job_id: str):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.accessed_at = time.time()
+            return job
+
+    def cancel(self, job_id: str):
+        job = self.get(job_id)
+        if job is not None:
+            job.cancel_requested = True
+            job.stop_event.set()
+
+    def _remove_expired(self):
+        now = time.time()
+        finished = [job for job in self._jobs.values() if job.finished_at is not None]
+        expired = [job.id for job in finished if now - job.finished_at > self.ttl_seconds]
+
+        # Keep the most recently used finished jobs within the limit
+        finished = [job for job in finished if job.id not in expired]
+        if len(finished) > self.max_finished_jobs:
+            finished.sort(key=lambda job: job.accessed_at)
+            expired += [job.id for job in finished[: len(finished) - self.max_finished_jobs]]
+
+        for job_id in expired:
+            job = self._jobs.pop(job_id)
+            if job.key is not None and self._jobs_by_key.get(job.key) == job_id:
+                del self._jobs_by_key[job.key]
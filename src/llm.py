@@ -0,0 +1,119 @@
+import asyncio
+import os
+import random
+import threading
+import time
+import weakref
+
+DEFAULT_BASE_URL = "https://api.openai.com/v1"
+
+
+def _retryable_errors():
+    # Rate limits, server errors and network problems (openai is imported
+    # on first use, as it is slow to import)
+    import openai
+
+    return (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError)
+
+
+class LLMBackend:
+    """Chat completions through pooled OpenAI clients.
+
+    Clients are created once per API key (and per event loop for the async
+    client) and reused, so HTTP connections are kept alive across calls.
+    Rate-limited (429), failed (5xx) and timed out requests are retried
+    with full-jitter exponential backoff. `base_url` points the backend to
+    any OpenAI-compatible server; if it is None, the OPENAI_BASE_URL
+    environment variable or the official API is used.
+    """
+
+    def __init__(
+        self,
+        base_url: str = None,
+        timeout: float = 60.0,
+        max_retries: int = 5,
+        backoff_base: float = 1.0,
+        backoff_max: float = 30.0,
+    ):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._clients = {}
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    @property
+    def endpoint(self):
+        # Base URL the requests are sent to, resolved like the OpenAI client does
+        return (self.base_url or os.environ.get("OPENAI_BASE_URL") or DEFAULT_BASE_URL).rstrip("/")
+
+    @staticmethod
+    def resolve_api_key(api_key: str = None, model: str = "gpt-3.5-turbo"):
+        # The default model may use the key from the environment, all other
+        # models need the user's own key
+        if api_key is None and model != "gpt-3.5-turbo":
+            raise ValueError("Please provide an OpenAI API key.")
+        return api_key
+
+    def _client_kwargs(self, api_key: str):
+        kwargs = {"timeout": self.timeout, "max_retries": 0}  # retries are done here
+        if api_key is not None:
+            kwargs["api_key"] = api_key
+        if self.base_url is not None:
+            kwargs["base_url"] = self.base_url
+        return kwargs
+
+    def client(self, api_key: str = None, model: str = "gpt-3.5-turbo"):
+        api_key = self.resolve_api_key(api_key, model)
+        with self._lock:
+            if api_key not in self._clients:
+                from openai import OpenAI
+
+                self._clients[api_key] = OpenAI(**self._client_kwargs(api_key))
+            return self._clients[api_key]
+
+    def async_client(self, api_key: str = None, model: str = "gpt-3.5-turbo"):
+        # Async connections belong to the event loop they were opened in, so
+        # there is one pool per loop (dropped together with the loop)
+        api_key = self.resolve_api_key(api_key, model)
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            clients = self._async_clients.setdefault(loop, {})
+            if api_key not in clients:
+                from openai import AsyncOpenAI
+
+                clients[api_key] = AsyncOpenAI(**self._client_kwargs(api_key))
+            return clients[api_key]
+
+    def _backoff(self, attempt: int, error: Exception):
+        # Honor the server's Retry-After header, otherwise use full jitter
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        try:
+            return min(float(retry_after), self.backoff_max)
+        except (TypeError, ValueError):
+            return random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))
+
+    def create(self, api_key: str = None, model: str = "gpt-3.5-turbo", **kwargs):
+        """`chat.completions.create` with retries. With `stream=True`, only
+        opening the stream is retried."""
+        client = self.client(api_key, model)
+        for attempt in range(self.max_retries + 1):
+            try:
+                return client.chat.completions.create(model=model, **kwargs)
+            except _retryable_errors() as e:
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(self._backoff(attempt, e))
+
+    async def create_async(self, api_key: str = None, model: str = "gpt-3.5-turbo", **kwargs):
+        client = self.async_client(api_key, model)
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await client.chat.completions.create(model=model, **kwargs)
+            except _retryable_errors() as e:
+                if attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(self._backoff(attempt, e))
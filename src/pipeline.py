@@ -0,0 +1,263 @@
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pandas as pd
+
+from src.dedup import collapse_near_duplicates
+from src.instrumentation import metrics
+from src.utils import (
+    MAP_CHUNK_TOKENS,
+    REDUCE_FAN_IN,
+    STOP_GRACE_PERIOD,
+    POSITIVE_INSTRUCTION,
+    NEGATIVE_INSTRUCTION,
+    _chunk_bounds,
+    app_data_from_url,
+    build_prompt,
+    build_reduce_prompt,
+    count_tokens_batch,
+    format_reviews,
+    get_llm_recommendations,
+    get_llm_summary,
+)
+
+REVIEW_COLUMNS = ["date", "title", "review", "rating"]
+
+
+def iter_review_pages(
+    url: str,
+    n_last_reviews: int = 100,
+    start_date: str = None,
+    end_date: str = None,
+    timeout: int = None,
+    stop_event: threading.Event = None,
+):
+    """Yield the reviews of an App Store app page by page (newest first),
+    while the next pages are scraped in the background.
+
+    Every page is a DataFrame limited to the date range. After `timeout`
+    seconds, scraping stops after the current page and the generator ends
+    with the pages loaded so far.
+    """
+    # Imported here, the scraper's dependencies are slow to import
+    from src.scraping import RateLimitedAppStore
+
+    country, app_name, app_id = app_data_from_url(url)
+    start_date = datetime.strptime(start_date or "2000-01-01", "%Y-%m-%d")
+    end_date = datetime.strptime(end_date, "%Y-%m-%d") if end_date else datetime.now()
+    if stop_event is None:
+        stop_event = threading.Event()
+
+    pages = queue.Queue()
+    finished = object()
+
+    def scrape_reviews():
+        try:
+            app = RateLimitedAppStore(
+                country=country,
+                app_name=app_name,
+                app_id=app_id,
+                stop_event=stop_event,
+                on_page=pages.put,
+            )
+            with metrics.stage("scrape", country=country) as event:
+                app.review(how_many=n_last_reviews, after=start_date)
+                event["reviews"] = len(app.reviews)
+        except Exception as e:
+            pages.put(e)
+        finally:
+            pages.put(finished)
+
+    thread = threading.Thread(target=scrape_reviews, daemon=True)
+    thread.start()
+
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    try:
+        while True:
+            if stop_event.is_set():
+                wait = STOP_GRACE_PERIOD
+            elif deadline is not None:
+                wait = max(deadline - time.monotonic(), 0)
+            else:
+                wait = None
+
+            try:
+                item = pages.get(timeout=wait)
+            except queue.Empty:
+                if stop_event.is_set():
+                    return  # the current page did not finish in time
+                # On timeout, ask the scraper to stop after its current page
+                stop_event.set()
+                continue
+
+            if item is finished:
+                return
+            if isinstance(item, Exception):
+                raise item
+
+            page = pd.DataFrame(item, columns=REVIEW_COLUMNS)
+            page = page[page["date"] < end_date]
+            if len(page) > 0:
+                yield page
+    finally:
+        # Also stop scraping if the consumer stops early
+        if thread.is_alive():
+            stop_event.set()
+
+
+class ChunkSummarizer:
+    """Summarizes reviews in chunks while they arrive.
+
+    Whenever the added reviews fill a chunk of `max_chunk_tokens`, the
+    chunk is summarized on `executor` (the map step of map-reduce
+    summarization), so summarizing overlaps with loading more reviews.
+    `result()` merges the partial summaries into one.
+    """
+
+    def __init__(
+        self,
+        executor: ThreadPoolExecutor,
+        instruction: str = "",
+        api_key: str = None,
+        model: str = "gpt-3.5-turbo",
+        max_chunk_tokens: int = MAP_CHUNK_TOKENS,
+        reduce_fan_in: int = REDUCE_FAN_IN,
+        merge_duplicates: bool = True,
+    ):
+        self.executor = executor
+        self.instruction = instruction
+        self.api_key = api_key
+        self.model = model
+        self.max_chunk_tokens = max_chunk_tokens
+        self.reduce_fan_in = reduce_fan_in
+        self.merge_duplicates = merge_duplicates
+        self.n_reviews = 0
+        self._pending = []
+        self._pending_tokens = 0
+        self._futures = []
+
+    def _summarize(self, prompt: str):
+        return get_llm_summary(prompt + self.instruction, api_key=self.api_key, model=self.model)
+
+    def _summarize_chunk(self, reviews: pd.DataFrame):
+        if self.merge_duplicates:
+            reviews = collapse_near_duplicates(reviews)
+        return self._summarize(build_prompt(reviews))
+
+    def _submit_chunks(self, final: bool):
+        reviews = pd.concat(self._pending, ignore_index=True)
+        token_counts = count_tokens_batch(format_reviews(reviews), model=self.model)
+        bounds = _chunk_bounds(token_counts, self.max_chunk_tokens)
+
+        # Keep the last (possibly incomplete) chunk open for more reviews
+        self._pending, self._pending_tokens = [], 0
+        if not final:
+            start, _ = bounds.pop()
+            self._pending = [reviews.iloc[start:]]
+            self._pending_tokens = int(token_counts[start:].sum())
+
+        for start, end in bounds:
+            self._futures.append(
+                self.executor.submit(self._summarize_chunk, reviews.iloc[start:end])
+            )
+
+    def add(self, reviews: pd.DataFrame):
+        if len(reviews) == 0:
+            return
+        self.n_reviews += len(reviews)
+        self._pending.append(reviews)
+        self._pending_tokens += int(
+            count_tokens_batch(format_reviews(reviews), model=self.model).sum()
+        )
+        if self._pending_tokens > self.max_chunk_tokens:
+            self._submit_chunks(final=False)
+
+    def close(self):
+        # Summarize the remaining reviews, no more reviews will be added
+        if self._pending:
+            self._submit_chunks(final=True)
+
+    def result(self):
+        self.close()
+        if len(self._futures) == 0:
+            return None
+        summaries = [future.result() for future in self._futures]
+
+        # Reduce: merge partial summaries in groups until one is left
+        while len(summaries) > 1:
+            groups = [
+                summaries[i : i + self.reduce_fan_in]
+                for i in range(0, len(summaries), self.reduce_fan_in)
+            ]
+            summaries = list(
+                self.executor.map(self._summarize, map(build_reduce_prompt, groups))
+            )
+        return summaries[0]
+
+
+def scrape_and_summarize(
+    url: str,
+    n_last_reviews: int = 100,
+    start_date: str = None,
+    end_date: str = None,
+    timeout: int = None,
+    api_key: str = None,
+    model: str = "gpt-3.5-turbo",
+    merge_duplicates: bool = True,
+    max_workers: int = 4,
+    stop_event: threading.Event = None,
+    on_page=None,
+):
+    """Scrape reviews and summarize them in one pipeline.
+
+    Reviews flow page by page from the scraper into one chunk summarizer
+    per sentiment, so the summaries of early pages are generated while
+    later pages are still being scraped. `on_page(n_reviews)` is called
+    after every page. Returns the reviews, both summaries and the
+    recommendations.
+    """
+    pages = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        summarizers = {
+            "positive": ChunkSummarizer(
+                executor, POSITIVE_INSTRUCTION, api_key, model, merge_duplicates=merge_duplicates
+            ),
+            "negative": ChunkSummarizer(
+                executor, NEGATIVE_INSTRUCTION, api_key, model, merge_duplicates=merge_duplicates
+            ),
+        }
+        for page in iter_review_pages(
+            url,
+            n_last_reviews=n_last_reviews,
+            start_date=start_date,
+            end_date=end_date,
+            timeout=timeout,
+            stop_event=stop_event,
+        ):
+            pages.append(page)
+            summarizers["positive"].add(page[page["rating"] > 3])
+            summarizers["negative"].add(page[page["rating"] < 4])
+            if on_page is not None:
+                on_page(sum(len(page) for page in pages))
+
+        # Submit the last chunks of both sentiments before waiting for either
+        for summarizer in summarizers.values():
+            summarizer.close()
+        positive_summary = summarizers["positive"].result()
+        negative_summary = summarizers["negative"].result()
+
+    if len(pages) == 0:
+        raise FileExistsError("Couldn't load reviews. Either there are no \
+                            reviews existing in the specified date range \
+                            or Apple returned a 429 error (too many requests).")
+
+    _, app_name, _ = app_data_from_url(url)
+    recommendations = get_llm_recommendations(
+        [positive_summary, negative_summary], app_name, api_key=api_key, model=model
+    )
+
+    reviews = pd.concat(pages, ignore_index=True).sort_values(by="date", ascending=False)
+    return reviews, positive_summary, negative_summary, recommendations
@@ -0,0 +1,167 @@
+import hashlib
+import os
+import sqlite3
+from contextlib import closing
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from src.cache import DEFAULT_CACHE_DIR
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Reviews can show up late with an earlier date, so every incremental scrape
+# goes back this far behind the watermark (duplicates are ignored)
+SCRAPE_OVERLAP = timedelta(days=2)
+
+
+class ReviewStore:
+    """Persistent per-(country, app_id) store of scraped App Store reviews.
+
+    For every app, the store records the date range for which all reviews
+    have been fetched, so that later requests only need to scrape reviews
+    newer than that range and can answer date range queries locally. The
+    range ends at the newest stored review (dates are naive UTC, as
+    returned by the App Store), never at the local clock.
+    """
+
+    def __init__(self, path: str = os.path.join(DEFAULT_CACHE_DIR, "reviews.sqlite")):
+        self.path = path
+        self._initialized = False
+
+    def _connect(self):
+        if not self._initialized:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+
+        conn = sqlite3.connect(self.path, timeout=30)
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS reviews (
+                    country TEXT NOT NULL,
+                    app_id TEXT NOT NULL,
+                    review_key TEXT NOT NULL,
+                    date TEXT NOT NULL,
+                    title TEXT,
+                    review TEXT,
+                    rating INTEGER,
+                    PRIMARY KEY (country, app_id, review_key)
+                )
+                """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_reviews_app_date "
+                "ON reviews (country, app_id, date)"
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS coverage (
+                    country TEXT NOT NULL,
+                    app_id TEXT NOT NULL,
+                    covered_from TEXT NOT NULL,
+                    covered_to TEXT NOT NULL,
+                    PRIMARY KEY (country, app_id)
+                )
+                """
+            )
+            self._initialized = True
+        return conn
+
+    def coverage(self, country: str, app_id: str):
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT covered_from, covered_to FROM coverage "
+                "WHERE country = ? AND app_id = ?",
+                (country, app_id),
+            ).fetchone()
+        if row is None:
+            return None
+        return tuple(datetime.strptime(value, DATE_FORMAT) for value in row)
+
+    def fetch_start(self, country: str, app_id: str, start_date: datetime):
+        # If everything since start_date is stored already, only reviews
+        # newer than the watermark (minus the overlap) need to be scraped
+        coverage = self.coverage(country, app_id)
+        if coverage is not None and coverage[0] <= start_date:
+            return max(coverage[1] - SCRAPE_OVERLAP, start_date)
+        return start_date
+
+    def add_reviews(
+        self,
+        country: str,
+        app_id: str,
+        reviews: pd.DataFrame,
+        fetched_from: datetime,
+        fetched_to: datetime,
+        complete: bool = True,
+    ):
+        # If the scrape stopped early (e.g. because of the review limit),
+        # only the range down to the oldest fetched review is complete
+        if not complete:
+            if len(reviews) == 0:
+                return
+            fetched_from = pd.to_datetime(reviews["date"]).min().to_pydatetime()
+
+        rows = []
+        if len(reviews) > 0:
+            dates = pd.to_datetime(reviews["date"]).dt.strftime(DATE_FORMAT)
+            for date, title, review, rating in zip(
+                dates, reviews["title"], reviews["review"], reviews["rating"]
+            ):
+                review_key = hashlib.sha256(
+                    f"{date}\x00{title}\x00{review}\x00{rating}".encode("utf-8")
+                ).hexdigest()
+                rows.append(
+                    (country, app_id, review_key, date, title, review, int(rating))
+                )
+
+        with closing(self._connect()) as conn, conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO reviews VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+            )
+
+            # Extend the covered range if the new range overlaps the old one,
+            # otherwise there is a gap and only the new range is complete
+            row = conn.execute(
+                "SELECT covered_from, covered_to FROM coverage "
+                "WHERE country = ? AND app_id = ?",
+                (country, app_id),
+            ).fetchone()
+            covered_from = fetched_from.strftime(DATE_FORMAT)
+            covered_to = fetched_to.strftime(DATE_FORMAT)
+            if row is not None and row[0] <= covered_to and covered_from <= row[1]:
+                covered_from = min(covered_from, row[0])
+                covered_to = max(covered_to, row[1])
+            conn.execute(
+                "INSERT OR REPLACE INTO coverage VALUES (?, ?, ?, ?)",
+                (country, app_id, covered_from, covered_to),
+            )
+
+    def query(
+        self,
+        country: str,
+        app_id: str,
+        start_date: datetime,
+        end_date: datetime,
+        limit: int = None,
+    ):
+        sql = (
+            "SELECT date, title, review, rating FROM reviews "
+            "WHERE country = ? AND app_id = ? AND date >= ? AND date < ? "
+            "ORDER BY date DESC"
+        )
+        params = [
+            country,
+            app_id,
+            start_date.strftime(DATE_FORMAT),
+            end_date.strftime(DATE_FORMAT),
+        ]
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+
+        with closing(self._connect()) as conn:
+            reviews = pd.read_sql_query(sql, conn, params=params)
+        reviews["date"] = pd.to_datetime(reviews["date"], format=DATE_FORMAT)
+        return reviews
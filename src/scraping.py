@@ -0,0 +1,126 @@
+import random
+import threading
+import time
+
+from app_store_scraper import AppStore
+
+
+class TokenBucket:
+    """Thread-safe token bucket limiting the rate of requests to the App Store."""
+
+    def __init__(self, rate: float = 2.0, capacity: int = 5):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated_at) * self.rate
+                )
+                self._updated_at = now
+
+                if now >= self._blocked_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                wait = max(
+                    self._blocked_until - now, (1 - self._tokens) / self.rate
+                )
+            time.sleep(wait)
+
+    def penalize(self, seconds: float):
+        # Pause all callers, e.g. after Apple answered with a 429
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+            self._tokens = 0
+
+
+# Rate limiter shared by all scrapers in this process
+RATE_LIMITER = TokenBucket()
+
+
+class RateLimitError(Exception):
+    pass
+
+
+class ScrapingCancelled(Exception):
+    pass
+
+
+class RateLimitedAppStore(AppStore):
+    """AppStore scraper whose page requests go through a shared rate limiter.
+
+    Rate-limited requests (HTTP 429) are retried with exponential backoff,
+    and the backoff pauses every scraper sharing the same limiter. If the
+    retries are exhausted, `review()` raises the RateLimitError after
+    scraping stopped; the reviews scraped before are kept. Setting
+    `stop_event` stops scraping before the next page; the reviews collected
+    so far are kept. `on_page` is called with the reviews of every page as
+    soon as it has been parsed.
+    """
+
+    def __init__(
+        self,
+        *args,
+        rate_limiter: TokenBucket = RATE_LIMITER,
+        max_retries: int = 5,
+        backoff_base: float = 1.0,
+        stop_event: threading.Event = None,
+        on_page=None,
+        **kwargs,
+    ):
+        # AppStore.__init__ already requests the token page through _get, so
+        # everything _get relies on must be set before
+        self.stop_event = stop_event
+        self.on_page = on_page
+        self._n_reported = 0
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.error = None
+        super().__init__(*args, **kwargs)
+
+    def _report_new_reviews(self):
+        if self.on_page is not None and len(self.reviews) > self._n_reported:
+            new_reviews = self.reviews[self._n_reported :]
+            self._n_reported = len(self.reviews)
+            self.on_page(new_reviews)
+
+    def review(self, *args, **kwargs):
+        # AppStore.review() only logs errors of its page requests, so they
+        # are recorded in _get and raised here
+        self.error = None
+        super().review(*args, **kwargs)
+        self._report_new_reviews()
+        if self.error is not None:
+            raise self.error
+
+    def _get(self, *args, **kwargs):
+        # The previous page has been parsed when the next one is requested
+        self._report_new_reviews()
+
+        # Raising here ends AppStore.review() and keeps the reviews scraped so far
+        if self.stop_event is not None and self.stop_event.is_set():
+            raise ScrapingCancelled("Scraping was cancelled.")
+
+        for attempt in range(self.max_retries):
+            self.rate_limiter.acquire()
+            # Without retries of the library's own session, every request
+            # and every backoff goes through the shared rate limiter
+            super()._get(*args, total=0, status_forcelist=[], **kwargs)
+            if self._response.status_code != 429:
+                return
+
+            backoff = self.backoff_base * 2**attempt
+            self.rate_limiter.penalize(backoff + random.uniform(0, self.backoff_base))
+
+        self.error = RateLimitError(
+            f"The App Store kept returning 429 errors after {self.max_retries} attempts."
+        )
+        raise self.error
@@ -1,11 +1,50 @@
 import pandas as pd
+import numpy as np
 import re
-from app_store_scraper import AppStore
 from datetime import datetime
 import io
-from openai import OpenAI
-import tiktoken
+import os
 import threading
+import asyncio
+import time
+import hashlib
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from src.cache import CompletionCache
+from src.review_store import ReviewStore
+from src.dedup import collapse_near_duplicates
+from src.instrumentation import metrics
+from src.llm import LLMBackend
+
+# Context windows (in tokens) of the supported models
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-3.5-turbo": 16385,
+    "gpt-4-0125-preview": 128000,
+}
+
+# Cache for LLM completions shared across sessions (set to None to disable)
+completion_cache = CompletionCache()
+
+# Pooled OpenAI clients with retries shared across sessions. Set the
+# OPENAI_BASE_URL environment variable (or pass base_url) to use another
+# OpenAI-compatible server.
+llm_backend = LLMBackend()
+
+# Tokens kept free in the context window for the system message and the answer
+RESPONSE_TOKEN_RESERVE = 1500
+
+# Defaults for map-reduce summarization of large review sets
+MAP_CHUNK_TOKENS = 6000
+REDUCE_FAN_IN = 8
+
+# Prices in USD per 1000 input and output tokens
+MODEL_PRICING = {
+    "gpt-3.5-turbo": {"input": 0.0005, "output": 0.0015},
+    "gpt-4-0125-preview": {"input": 0.01, "output": 0.03},
+}
+
+# Expected output length of a summary or recommendations (3-5 bullet points)
+EXPECTED_OUTPUT_TOKENS = 350
 
 
 def app_data_from_url(url):
@@ -21,13 +60,79 @@ def app_data_from_url(url):
     return country, app_name, app_id
 
 
+def _scrape_reviews(
+    country: str,
+    app_name: str,
+    app_id: str,
+    n_last_reviews: int,
+    start_date: datetime,
+    end_date: datetime,
+    store: ReviewStore = None,
+    stop_event: threading.Event = None,
+):
+    # Imported here, the scraper's dependencies are slow to import
+    from src.scraping import RateLimitedAppStore
+
+    app = RateLimitedAppStore(
+        country=country, app_name=app_name, app_id=app_id, stop_event=stop_event
+    )
+
+    if store is None:
+        with metrics.stage("scrape", country=country) as event:
+            app.review(how_many=n_last_reviews, after=start_date)
+            event["reviews"] = len(app.reviews)
+        return pd.DataFrame(app.reviews, columns=["date", "title", "review", "rating"])
+
+    # Only scrape reviews that are newer than what the store already holds
+    scrape_start = store.fetch_start(country, app_id, start_date)
+    try:
+        with metrics.stage("scrape", country=country) as event:
+            app.review(how_many=n_last_reviews, after=scrape_start)
+            event["reviews"] = len(app.reviews)
+    finally:
+        # Reviews scraped before a rate limit error are stored as well, but
+        # the range is only complete if scraping ended without an error
+        scraped = pd.DataFrame(app.reviews, columns=["date", "title", "review", "rating"])
+        cancelled = stop_event is not None and stop_event.is_set()
+        # The watermark is the newest review returned by Apple (in UTC like
+        # all review dates), not the local time of this host
+        fetched_to = (
+            pd.to_datetime(scraped["date"]).max().to_pydatetime()
+            if len(scraped) > 0
+            else scrape_start
+        )
+        store.add_reviews(
+            country,
+            app_id,
+            scraped,
+            fetched_from=scrape_start,
+            fetched_to=fetched_to,
+            # An empty response may also be caused by a 429 error, so it is
+            # never taken as proof that the range is complete
+            complete=app.error is None and 0 < len(scraped) < n_last_reviews and not cancelled,
+        )
+
+    # Serve the requested range from the local store
+    return store.query(country, app_id, start_date, end_date, limit=n_last_reviews)
+
+
+# Seconds to wait for a cancelled scraper to finish its current page
+STOP_GRACE_PERIOD = 10
+
+
 def app_store_reviews(
-    url: str, n_last_reviews: int = 100, start_date: str = None, end_date: str = None
+    url: str,
+    n_last_reviews: int = 100,
+    start_date: str = None,
+    end_date: str = None,
+    store: ReviewStore = None,
+    timeout: int = None,
+    return_partial: bool = False,
+    stop_event: threading.Event = None,
 ):
 
-    # Create AppStore object based on URL
+    # Get app identifiers based on URL
     country, app_name, app_id = app_data_from_url(url)
-    app = AppStore(country=country, app_name=app_name, app_id=app_id)
 
     # Convert dates to datetime objects
     if start_date:
@@ -40,11 +145,42 @@ def app_store_reviews(
     else:
         end_date = datetime.now()
 
-    # Scrape reviews for the specified App
-    app.review(how_many=n_last_reviews, after=start_date)
+    # Placeholders for results of the scraping thread
+    result = {}
+    if stop_event is None:
+        stop_event = threading.Event()
+
+    def scrape_reviews():
+        try:
+            result["reviews"] = _scrape_reviews(
+                country,
+                app_name,
+                app_id,
+                n_last_reviews,
+                start_date,
+                end_date,
+                store=store,
+                stop_event=stop_event,
+            )
+        except Exception as e:
+            result["error"] = e
+
+    # Scrape reviews for the specified App in a separate thread
+    thread = threading.Thread(target=scrape_reviews, daemon=True)
+    thread.start()
+    thread.join(timeout=timeout)
 
-    # Convert response to dataframe
-    reviews = pd.DataFrame(app.reviews)
+    # On timeout, ask the scraper to stop after its current page
+    timed_out = thread.is_alive()
+    if timed_out:
+        stop_event.set()
+        thread.join(timeout=STOP_GRACE_PERIOD)
+
+    if timed_out and (not return_partial or thread.is_alive()):
+        raise TimeoutError(f"Review scraping did not complete within {timeout} seconds.")
+    if "error" in result:
+        raise result["error"]
+    reviews = result["reviews"]
 
     # Throw an error if there are no reviews
     if len(reviews) == 0:
@@ -62,51 +198,54 @@ def app_store_reviews(
     reviews = reviews.sort_values(by="date", ascending=False)
     return reviews
 
-def app_store_reviews_with_timeout(url: str, n_last_reviews: int = 100, start_date: str = None, end_date: str = None, timeout: int = 60):
-    # Placeholders for results and completion flag
-    reviews_list = []
-    completed = False
-    end_date_dt = datetime.now()
-    
-    def scrape_reviews():
-        nonlocal reviews_list, completed, end_date_dt
-
-        # Create AppStore object based on URL
-        country, app_name, app_id = app_data_from_url(url)
-        app = AppStore(country=country, app_name=app_name, app_id=app_id)
-
-        # Convert dates to datetime objects
-        if start_date:
-            start_date_dt = datetime.strptime(start_date, "%Y-%m-%d")
-        else:
-            start_date_dt = datetime.strptime("2000-01-01", "%Y-%m-%d")
-
-        if end_date:
-            end_date_dt = datetime.strptime(end_date, "%Y-%m-%d")
-        else:
-            end_date_dt = datetime.now()
-
-        # Scrape reviews for the specified App
-        app.review(how_many=n_last_reviews, after=start_date_dt)
-
-        # Store the scraped reviews
-        reviews_list = app.reviews
-        
-        # Mark completion
-        completed = True
-
-    # Start scraping in a separate thread
-    thread = threading.Thread(target=scrape_reviews)
-    thread.start()
+def app_store_reviews_with_timeout(url: str, n_last_reviews: int = 100, start_date: str = None, end_date: str = None, timeout: int = 60, store: ReviewStore = None, return_partial: bool = False, stop_event: threading.Event = None):
+    return app_store_reviews(
+        url,
+        n_last_reviews=n_last_reviews,
+        start_date=start_date,
+        end_date=end_date,
+        store=store,
+        timeout=timeout,
+        return_partial=return_partial,
+        stop_event=stop_event,
+    )
 
-    # Wait for 30 seconds or until the thread finishes
-    thread.join(timeout=timeout)
 
-    if not completed:
-        raise TimeoutError(f"Review scraping did not complete within {timeout} seconds.")
-    
-    # Convert response to dataframe, assuming scraping was successful
-    reviews = pd.DataFrame(reviews_list)
+def app_store_reviews_multi_country(
+    url: str,
+    countries: list,
+    n_last_reviews: int = 100,
+    start_date: str = None,
+    end_date: str = None,
+    max_workers: int = 4,
+    store: ReviewStore = None,
+):
+    # The country in the URL is ignored in favor of the given storefronts
+    _, app_name, app_id = app_data_from_url(url)
+
+    # Convert dates to datetime objects
+    if start_date:
+        start_date = datetime.strptime(start_date, "%Y-%m-%d")
+    else:
+        start_date = datetime.strptime("2000-01-01", "%Y-%m-%d")
+
+    if end_date:
+        end_date = datetime.strptime(end_date, "%Y-%m-%d")
+    else:
+        end_date = datetime.now()
+
+    def scrape_country(country):
+        reviews = _scrape_reviews(
+            country, app_name, app_id, n_last_reviews, start_date, end_date, store=store
+        )
+        reviews["country"] = country
+        return reviews
+
+    # Scrape all storefronts concurrently (requests share one rate limiter)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        reviews = pd.concat(
+            list(executor.map(scrape_country, countries)), ignore_index=True
+        )
 
     # Throw an error if there are no reviews
     if len(reviews) == 0:
@@ -115,15 +254,109 @@ def app_store_reviews_with_timeout(url: str, n_last_reviews: int = 100, start_da
                             or Apple returned a 429 error (too many requests).")
 
     # Final filtering and sorting
-    reviews = reviews.loc[:, ["date", "title", "review", "rating"]]
-    reviews = reviews[reviews["date"] < end_date_dt]
+    reviews = reviews.loc[:, ["date", "title", "review", "rating", "country"]]
+    reviews = reviews[reviews["date"] < end_date]
     reviews = reviews.sort_values(by="date", ascending=False)
 
     return reviews
 
-def build_prompt(reviews=None):
+def compact_reviews(reviews: pd.DataFrame):
+    """Copy of the reviews in a compact representation for keeping them in
+    memory: Arrow-backed strings, int8 ratings and datetime64 dates. All
+    other columns are dropped, as derived data is computed on demand.
+    """
+    columns = {}
+    if "date" in reviews.columns:
+        columns["date"] = pd.to_datetime(reviews["date"], errors="coerce").to_numpy()
+    for col in ["title", "review"]:
+        columns[col] = reviews[col].fillna("").astype("string[pyarrow]").array
+    columns["rating"] = reviews["rating"].to_numpy().astype("int8")
+    if "country" in reviews.columns:
+        columns["country"] = reviews["country"].astype("category").array
+    return pd.DataFrame(columns)
 
-    prompt = """
+
+def dataset_fingerprint(reviews: pd.DataFrame):
+    # Content hash of the reviews, independent of row labels
+    columns = [col for col in ["date", "title", "review", "rating"] if col in reviews.columns]
+    row_hashes = pd.util.hash_pandas_object(reviews[columns], index=False)
+    return hashlib.sha256(row_hashes.to_numpy().tobytes()).hexdigest()
+
+
+# Instructions appended to the summary prompts
+POSITIVE_INSTRUCTION = "\n\nFor this analysis, only the positive reviews have been selected. \
+            Please summarize the positive highlights in the user feedback."
+NEGATIVE_INSTRUCTION = "\n\nFor this analysis, only critical reviews have been selected. \
+        Please summarize the key critical issues raised in the user feedback."
+
+
+@metrics.timed("split_reviews", count_first_arg=True)
+def split_reviews(
+    reviews: pd.DataFrame,
+    merge_duplicates: bool = True,
+    max_representative_reviews: int = None,
+):
+    positive_reviews = reviews[reviews["rating"] > 3].sample(frac=1)
+    negative_reviews = reviews[reviews["rating"] < 4].sample(frac=1)
+
+    # Collapse near-duplicate reviews so each piece of feedback is paid for once
+    if merge_duplicates:
+        positive_reviews = collapse_near_duplicates(positive_reviews)
+        negative_reviews = collapse_near_duplicates(negative_reviews)
+
+    # Summarize large datasets from the most representative reviews per theme
+    if max_representative_reviews is not None:
+        from src.clustering import representative_reviews
+
+        positive_reviews = representative_reviews(
+            positive_reviews, max_reviews=max_representative_reviews
+        )
+        negative_reviews = representative_reviews(
+            negative_reviews, max_reviews=max_representative_reviews
+        )
+
+    return positive_reviews, negative_reviews
+
+
+def format_reviews(reviews: pd.DataFrame):
+    # Text of every review as it appears in the prompt
+    texts = (
+        "Review title: "
+        + reviews["title"].astype("str")
+        + "\nReview rating: "
+        + reviews["rating"].astype("str")
+        + "/5"
+        "\nReview text: " + reviews["review"].astype("str")
+    )
+
+    # Surface how many near-identical reviews a collapsed review stands for
+    if "duplicate_count" in reviews.columns:
+        texts = texts + np.where(
+            reviews["duplicate_count"] > 1,
+            "\nNumber of near-identical reviews: "
+            + reviews["duplicate_count"].astype("str"),
+            "",
+        )
+
+    return texts + "\n\n"
+
+
+def _stratified_order(reviews: pd.DataFrame):
+    # Rank reviews by recency within their rating, then interleave the
+    # ratings proportionally to their share of all reviews
+    if "date" in reviews.columns:
+        dates = pd.to_datetime(reviews["date"], errors="coerce")
+        recency_rank = dates.groupby(reviews["rating"].to_numpy()).rank(
+            method="first", ascending=False, na_option="bottom"
+        )
+    else:
+        recency_rank = reviews.groupby("rating").cumcount() + 1
+    group_size = reviews.groupby("rating")["rating"].transform("size")
+    share_position = ((recency_rank - 0.5) / group_size).to_numpy()
+    return np.lexsort((reviews["rating"].to_numpy(), share_position))
+
+
+SUMMARY_PROMPT_HEADER = """
 Synthesize the key points from the following app store reviews into one single summary in English language using bullet points. 
 Create between 3 and 5 bullet points in order to mention only the most important and frequent feedback. 
 You can find the reviews below, along with their respective ratings, where 1/5 is worst and 5/5 ist best.
@@ -132,48 +365,311 @@ Use bolded text for important aspects to improve readability.
 
 """
 
-    reviews["complete_info_for_prompting"] = (
-        "Review title: "
-        + reviews["title"]
-        + "\nReview rating: "
-        + reviews["rating"].astype("str")
-        + "/5"
-        "\nReview text: " + reviews["review"] + "\n\n"
+
+DUPLICATES_NOTE = """Near-identical reviews have been merged into one review. Their number indicates how frequent the feedback is.
+
+"""
+
+THEMES_NOTE = """The reviews are grouped into themes. Each theme shows a selection of representative reviews and the total number of reviews about this theme, which indicates how frequent the feedback is.
+
+"""
+
+
+@metrics.timed("build_prompt", count_first_arg=True)
+def build_prompt(reviews=None, token_budget: int = None, model: str = "gpt-3.5-turbo"):
+
+    prompt = SUMMARY_PROMPT_HEADER
+    if "duplicate_count" in reviews.columns:
+        prompt += DUPLICATES_NOTE
+    has_themes = "cluster" in reviews.columns
+    if has_themes:
+        prompt += THEMES_NOTE
+
+    review_texts = format_reviews(reviews).to_numpy()
+    selected = np.ones(len(review_texts), dtype=bool)
+
+    if token_budget is not None:
+        # Pack reviews into the budget, stratified by rating and recency.
+        # Reviews that don't fit are skipped so smaller ones can fill the gap.
+        # (Theme headings are short and not included in the budget.)
+        token_counts = count_tokens_batch(review_texts, model=model)
+        remaining_budget = token_budget - count_tokens(prompt, model=model)
+        selected[:] = False
+        for i in _stratified_order(reviews):
+            if token_counts[i] <= remaining_budget:
+                selected[i] = True
+                remaining_budget -= token_counts[i]
+
+    if not has_themes:
+        return prompt + "".join(review_texts[selected])
+
+    # Group reviews by theme, starting with the most frequent theme
+    review_texts = review_texts[selected]
+    clusters = reviews["cluster"].to_numpy()[selected]
+    cluster_sizes = reviews["cluster_size"].to_numpy()[selected]
+    order = np.lexsort((clusters, -cluster_sizes))
+    sections = []
+    for theme_number, cluster in enumerate(pd.unique(clusters[order])):
+        members = clusters == cluster
+        sections.append(
+            f"Theme {theme_number + 1} ({cluster_sizes[members][0]} reviews):\n\n"
+            + "".join(review_texts[members])
+        )
+    return prompt + "".join(sections)
+
+
+SUMMARY_SYSTEM_MESSAGE = "You are an expert user researcher, skilled in summarizing and explaining user feedback."
+RECOMMENDATIONS_SYSTEM_MESSAGE = "You are an expert user researcher, skilled in providing\
+                      actionable product recommendations based on user feedback."
+
+
+def _messages(system_message: str, prompt: str):
+    return [
+        {"role": "system", "content": system_message},
+        {"role": "user", "content": prompt},
+    ]
+
+
+def _cache_key(messages: list, model: str, base_url: str = None):
+    # Completions are kept apart per server (by default the backend's)
+    if completion_cache is None:
+        return None
+    return completion_cache.make_key(model, messages, base_url or llm_backend.endpoint)
+
+
+def _cache_get(key: str):
+    if key is None or completion_cache is None:
+        return None
+    return completion_cache.get(key)
+
+
+def _cache_set(key: str, response: str):
+    if key is not None and completion_cache is not None and response:
+        completion_cache.set(key, response)
+
+
+def _record_usage(event: dict, usage):
+    if usage is not None:
+        event["prompt_tokens"] = usage.prompt_tokens
+        event["completion_tokens"] = usage.completion_tokens
+
+
+def _complete(messages: list, api_key: str, model: str):
+    cache_key = _cache_key(messages, model)
+    cached_response = _cache_get(cache_key)
+    if cached_response is not None:
+        return cached_response
+
+    with metrics.stage("llm", model=model) as event:
+        completion = llm_backend.create(api_key, model, messages=messages)
+        _record_usage(event, completion.usage)
+    response = completion.choices[0].message.content
+    _cache_set(cache_key, response)
+    return response
+
+
+async def _complete_async(messages: list, api_key: str, model: str):
+    cache_key = _cache_key(messages, model)
+    cached_response = _cache_get(cache_key)
+    if cached_response is not None:
+        return cached_response
+
+    with metrics.stage("llm", model=model) as event:
+        completion = await llm_backend.create_async(api_key, model, messages=messages)
+        _record_usage(event, completion.usage)
+    response = completion.choices[0].message.content
+    _cache_set(cache_key, response)
+    return response
+
+
+def get_llm_summary(prompt: str, api_key: str = None, model: str = "gpt-3.5-turbo"):
+    return _complete(_messages(SUMMARY_SYSTEM_MESSAGE, prompt), api_key, model)
+
+
+async def get_llm_summary_async(
+    prompt: str, api_key: str = None, model: str = "gpt-3.5-turbo"
+):
+    return await _complete_async(
+        _messages(SUMMARY_SYSTEM_MESSAGE, prompt), api_key, model
+    )
+
+
+def _count_message_tokens(messages: list):
+    # Every message carries a few formatting tokens, and the reply is primed
+    # with a few more (see the OpenAI cookbook on counting chat tokens)
+    return sum(count_tokens(message["content"]) + 3 for message in messages) + 3
+
+
+def _stream_completion(messages: list, api_key: str, model: str, usage: dict = None):
+    # Cached responses are returned in one piece without any API usage
+    cache_key = _cache_key(messages, model)
+    cached_response = _cache_get(cache_key)
+    if cached_response is not None:
+        if usage is not None:
+            usage.update(prompt_tokens=0, completion_tokens=0, cached=True)
+        yield cached_response
+        return
+
+    event_start = time.perf_counter()
+    with metrics.stage("llm_stream", model=model) as event:
+        stream = llm_backend.create(api_key, model, messages=messages, stream=True)
+
+        response_parts = []
+        for chunk in stream:
+            if len(chunk.choices) == 0:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                if not response_parts:
+                    event["seconds_to_first_token"] = time.perf_counter() - event_start
+                response_parts.append(delta)
+                yield delta
+        _cache_set(cache_key, "".join(response_parts))
+
+        # Streamed responses carry no usage information in this version of the
+        # OpenAI client, so count the tokens locally once the stream is complete
+        event["prompt_tokens"] = _count_message_tokens(messages)
+        event["completion_tokens"] = count_tokens("".join(response_parts))
+        if usage is not None:
+            usage["prompt_tokens"] = event["prompt_tokens"]
+            usage["completion_tokens"] = event["completion_tokens"]
+
+
+def stream_llm_summary(
+    prompt: str, api_key: str = None, model: str = "gpt-3.5-turbo", usage: dict = None
+):
+    yield from _stream_completion(
+        _messages(SUMMARY_SYSTEM_MESSAGE, prompt), api_key, model, usage=usage
     )
 
-    prompt += reviews["complete_info_for_prompting"].sum()
+
+def max_prompt_tokens(model: str = "gpt-3.5-turbo"):
+    if model not in MODEL_CONTEXT_WINDOWS:
+        raise ValueError(f"Model name {model} is unknown.")
+    return MODEL_CONTEXT_WINDOWS[model] - RESPONSE_TOKEN_RESERVE
+
+
+def _chunk_bounds(token_counts, max_tokens: int):
+    # Greedily fill chunks up to the token budget (a single review that
+    # exceeds the budget on its own still gets a chunk of its own)
+    bounds = []
+    chunk_start = 0
+    chunk_tokens = 0
+    for i, n_tokens in enumerate(token_counts):
+        if chunk_tokens + n_tokens > max_tokens and i > chunk_start:
+            bounds.append((chunk_start, i))
+            chunk_start = i
+            chunk_tokens = 0
+        chunk_tokens += n_tokens
+    if chunk_start < len(token_counts):
+        bounds.append((chunk_start, len(token_counts)))
+    return bounds
+
+
+def chunk_reviews(
+    reviews: pd.DataFrame,
+    max_tokens: int = MAP_CHUNK_TOKENS,
+    model: str = "gpt-3.5-turbo",
+):
+    # Token length of every review as it will appear in the prompt
+    token_counts = count_tokens_batch(format_reviews(reviews), model=model)
+    return [
+        reviews.iloc[start:end] for start, end in _chunk_bounds(token_counts, max_tokens)
+    ]
+
+
+REDUCE_PROMPT_HEADER = """
+Below you will find several partial summaries, each created from a different subset of app store reviews of the same app.
+Merge them into one single summary in English language using bullet points.
+Create between 3 and 5 bullet points in order to mention only the most important and frequent feedback.
+Points that appear in several partial summaries are more frequent and should be prioritized.
+Output only the bullet points and nothing else. Each bullet point should contain 2 sentences.
+Use bolded text for important aspects to improve readability.
+
+"""
+
+
+def build_reduce_prompt(summaries: list):
+
+    prompt = REDUCE_PROMPT_HEADER
+
+    for i, summary in enumerate(summaries):
+        prompt += f"Partial summary {i + 1}:\n{summary}\n\n"
 
     return prompt
 
 
-def get_llm_summary(prompt: str, api_key: str = None, model: str = "gpt-3.5-turbo"):
-    if api_key is None and model == "gpt-3.5-turbo":
-        client = OpenAI() # use environment variable
-    elif api_key is None and model != "gpt-3.5-turbo":
-        raise ValueError("Please provide an OpenAI API key.")
-    else:
-        client = OpenAI(api_key=api_key)
+def _partial_summaries(
+    reviews: pd.DataFrame,
+    instruction: str,
+    api_key: str,
+    model: str,
+    max_chunk_tokens: int,
+    reduce_fan_in: int,
+    max_workers: int,
+    max_summaries: int = 1,
+):
+    if reduce_fan_in < 2:
+        raise ValueError("reduce_fan_in must be at least 2.")
+
+    def summarize(prompt):
+        return get_llm_summary(prompt + instruction, api_key=api_key, model=model)
+
+    # Map: summarize every chunk of reviews in parallel
+    chunks = chunk_reviews(reviews, max_tokens=max_chunk_tokens, model=model)
+    prompts = [build_prompt(chunk) for chunk in chunks]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        summaries = list(executor.map(summarize, prompts))
+
+        # Reduce: merge partial summaries in groups until few enough are left
+        while len(summaries) > max_summaries:
+            groups = [
+                summaries[i : i + reduce_fan_in]
+                for i in range(0, len(summaries), reduce_fan_in)
+            ]
+            summaries = list(executor.map(summarize, map(build_reduce_prompt, groups)))
+
+    return summaries
 
-    completion = client.chat.completions.create(
+
+def get_llm_summary_map_reduce(
+    reviews: pd.DataFrame,
+    instruction: str = "",
+    api_key: str = None,
+    model: str = "gpt-3.5-turbo",
+    max_chunk_tokens: int = MAP_CHUNK_TOKENS,
+    reduce_fan_in: int = REDUCE_FAN_IN,
+    max_workers: int = 4,
+):
+    summaries = _partial_summaries(
+        reviews,
+        instruction,
+        api_key=api_key,
         model=model,
-        messages=[
-            {
-                "role": "system",
-                "content": "You are an expert user researcher, skilled in summarizing and explaining user feedback.",
-            },
-            {"role": "user", "content": prompt},
-        ],
+        max_chunk_tokens=max_chunk_tokens,
+        reduce_fan_in=reduce_fan_in,
+        max_workers=max_workers,
     )
-    return completion.choices[0].message.content
+    return summaries[0]
 
-def get_llm_recommendations(summaries: list, app_name: str, api_key: str = None, model: str = "gpt-3.5-turbo"):
-    if api_key is None and model == "gpt-3.5-turbo":
-        client = OpenAI() # use environment variable
-    elif api_key is None and model != "gpt-3.5-turbo":
-        raise ValueError("Please provide an OpenAI API key.")
-    else:
-        client = OpenAI(api_key=api_key)
 
+def summarize_reviews(
+    reviews: pd.DataFrame,
+    instruction: str = "",
+    api_key: str = None,
+    model: str = "gpt-3.5-turbo",
+):
+    # Use a single call if all reviews fit into the context window,
+    # otherwise fall back to chunked map-reduce summarization
+    prompt = build_prompt(reviews) + instruction
+    if count_tokens(prompt, model=model) <= max_prompt_tokens(model):
+        return get_llm_summary(prompt, api_key=api_key, model=model)
+    return get_llm_summary_map_reduce(
+        reviews, instruction=instruction, api_key=api_key, model=model
+    )
+
+def build_recommendations_prompt(summaries: list, app_name: str):
     prompt = f"Below you will find summarized user feedback for the \
             app {app_name} based on App Store reviews. Suggest concrete improvements to improve \
             the app based on this feedback, using 3 to 5 bullet points. Output only the bullet points and nothing else.\
@@ -184,34 +680,393 @@ def get_llm_recommendations(summaries: list, app_name: str, api_key: str = None,
             continue
         prompt += summary + "\n\n"
 
-    completion = client.chat.completions.create(
+    return prompt
+
+
+def get_llm_recommendations(summaries: list, app_name: str, api_key: str = None, model: str = "gpt-3.5-turbo"):
+    messages = _messages(
+        RECOMMENDATIONS_SYSTEM_MESSAGE,
+        build_recommendations_prompt(summaries, app_name),
+    )
+    return _complete(messages, api_key, model)
+
+
+async def get_llm_recommendations_async(
+    summaries: list, app_name: str, api_key: str = None, model: str = "gpt-3.5-turbo"
+):
+    messages = _messages(
+        RECOMMENDATIONS_SYSTEM_MESSAGE,
+        build_recommendations_prompt(summaries, app_name),
+    )
+    return await _complete_async(messages, api_key, model)
+
+
+def stream_llm_recommendations(
+    summaries: list,
+    app_name: str,
+    api_key: str = None,
+    model: str = "gpt-3.5-turbo",
+    usage: dict = None,
+):
+    yield from _stream_completion(
+        _messages(
+            RECOMMENDATIONS_SYSTEM_MESSAGE,
+            build_recommendations_prompt(summaries, app_name),
+        ),
+        api_key,
+        model,
+        usage=usage,
+    )
+
+
+def stream_reviews_summary(
+    reviews: pd.DataFrame,
+    instruction: str = "",
+    api_key: str = None,
+    model: str = "gpt-3.5-turbo",
+    usage: dict = None,
+    reduce_fan_in: int = REDUCE_FAN_IN,
+):
+    prompt = build_prompt(reviews) + instruction
+    if count_tokens(prompt, model=model) <= max_prompt_tokens(model):
+        yield from stream_llm_summary(prompt, api_key=api_key, model=model, usage=usage)
+        return
+
+    # For large review sets, only the final reduce step can be streamed
+    summaries = _partial_summaries(
+        reviews,
+        instruction,
+        api_key=api_key,
+        model=model,
+        max_chunk_tokens=MAP_CHUNK_TOKENS,
+        reduce_fan_in=reduce_fan_in,
+        max_workers=4,
+        max_summaries=reduce_fan_in,
+    )
+    if len(summaries) == 1:
+        yield summaries[0]
+        return
+    yield from stream_llm_summary(
+        build_reduce_prompt(summaries) + instruction,
+        api_key=api_key,
         model=model,
-        messages=[
-            {
-                "role": "system",
-                "content": "You are an expert user researcher, skilled in providing\
-                      actionable product recommendations based on user feedback.",
-            },
-            {"role": "user", "content": prompt},
-        ],
-    )
-    return completion.choices[0].message.content
-
-def count_tokens(prompt):
-    enc = tiktoken.get_encoding("cl100k_base")
-    token_count = len(enc.encode(prompt))
-    return token_count
+        usage=usage,
+    )
+
+
+async def summarize_reviews_async(
+    reviews: pd.DataFrame,
+    instruction: str = "",
+    api_key: str = None,
+    model: str = "gpt-3.5-turbo",
+):
+    prompt = build_prompt(reviews) + instruction
+    if count_tokens(prompt, model=model) <= max_prompt_tokens(model):
+        return await get_llm_summary_async(prompt, api_key=api_key, model=model)
+
+    # The map-reduce path parallelizes internally, so run it off the event loop
+    return await asyncio.to_thread(
+        get_llm_summary_map_reduce,
+        reviews,
+        instruction=instruction,
+        api_key=api_key,
+        model=model,
+    )
+
+
+async def generate_insights_async(
+    positive_reviews: pd.DataFrame,
+    negative_reviews: pd.DataFrame,
+    app_name: str,
+    positive_instruction: str = "",
+    negative_instruction: str = "",
+    api_key: str = None,
+    model: str = "gpt-3.5-turbo",
+):
+    async def summarize(reviews, instruction):
+        if reviews is None or len(reviews) == 0:
+            return None
+        return await summarize_reviews_async(
+            reviews, instruction=instruction, api_key=api_key, model=model
+        )
+
+    # Both summaries are independent, so request them concurrently
+    positive_summary, negative_summary = await asyncio.gather(
+        summarize(positive_reviews, positive_instruction),
+        summarize(negative_reviews, negative_instruction),
+    )
+
+    # Recommendations depend on both summaries
+    recommendations = None
+    if positive_summary is not None or negative_summary is not None:
+        recommendations = await get_llm_recommendations_async(
+            summaries=[positive_summary, negative_summary],
+            app_name=app_name,
+            api_key=api_key,
+            model=model,
+        )
+
+    return positive_summary, negative_summary, recommendations
+
+
+def generate_insights(*args, **kwargs):
+    return asyncio.run(generate_insights_async(*args, **kwargs))
+
+
+# Directory with the tokenizer's BPE files, named like in tiktoken's own
+# cache (so a directory pre-warmed by tiktoken works as well). Pre-warm it
+# while building the app (`python -m src.warm_tokenizer`), so that counting
+# tokens needs no download at runtime.
+TOKENIZER_CACHE_DIR = os.environ.get("USER_REVIEWS_TOKENIZER_DIR") or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "assets", "tiktoken"
+)
+
+
+def _load_bpe_file(url: str, expected_hash: str = None, cache_dir: str = TOKENIZER_CACHE_DIR):
+    # tiktoken's load_tiktoken_bpe on a local copy of the file in cache_dir,
+    # which is downloaded if it is missing
+    from tiktoken.load import check_hash, load_tiktoken_bpe, read_file
+
+    path = os.path.join(cache_dir, hashlib.sha1(url.encode()).hexdigest())
+    if not os.path.exists(path):
+        contents = read_file(url)
+        if expected_hash and not check_hash(contents, expected_hash):
+            raise ValueError(f"The download of {url} is corrupted, please try again.")
+
+        # Write atomically, other processes may load the file at the same time
+        os.makedirs(cache_dir, exist_ok=True)
+        temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary_path, "wb") as f:
+            f.write(contents)
+        os.replace(temporary_path, path)
+    return load_tiktoken_bpe(path, expected_hash=expected_hash)
+
+
+@lru_cache(maxsize=None)
+def _load_encoding(name: str, cache_dir: str = TOKENIZER_CACHE_DIR):
+    import types
+
+    import tiktoken
+    from tiktoken_ext.openai_public import ENCODING_CONSTRUCTORS
+
+    # tiktoken's own constructor of the encoding (pattern, special tokens,
+    # URL and hash of the BPE file), with its BPE file loaded from cache_dir
+    # instead of the directory set by the environment
+    constructor = ENCODING_CONSTRUCTORS[name]
+    local_constructor = types.FunctionType(
+        constructor.__code__,
+        {
+            **constructor.__globals__,
+            "load_tiktoken_bpe": lambda url, expected_hash=None: _load_bpe_file(
+                url, expected_hash, cache_dir
+            ),
+        },
+    )
+    return tiktoken.Encoding(**local_constructor())
+
+
+def _encoding(model: str = "gpt-3.5-turbo"):
+    import tiktoken
+
+    try:
+        name = tiktoken.encoding_name_for_model(model)
+    except KeyError:
+        name = "cl100k_base"
+    return _load_encoding(name, TOKENIZER_CACHE_DIR)
+
+
+def warm_tokenizer(models=tuple(MODEL_CONTEXT_WINDOWS)):
+    # Load the encodings ahead of the first token count (downloading their
+    # BPE files into the cache directory if they are missing)
+    for model in models:
+        _encoding(model)
+
+
+class Tokenizer:
+    """Counts tokens with the cached encoding of each model.
+
+    Token counts of individual texts (e.g. reviews) are memoized by a hash
+    of the text, so repeated counting of the same reviews is a dict lookup.
+    """
+
+    def __init__(self, max_cached_texts: int = 1_000_000, num_threads: int = 8):
+        self.max_cached_texts = max_cached_texts
+        self.num_threads = num_threads
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _text_key(encoding_name: str, text: str):
+        digest = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+        return encoding_name, digest
+
+    def count(self, text: str, model: str = "gpt-3.5-turbo"):
+        return len(_encoding(model).encode(text))
+
+    def count_batch(self, texts, model: str = "gpt-3.5-turbo"):
+        enc = _encoding(model)
+        keys = [self._text_key(enc.name, text) for text in texts]
+        counts = np.empty(len(keys), dtype=np.int64)
+
+        # Look up memoized counts and collect the texts that are still missing
+        missing = {}
+        with self._lock:
+            for i, key in enumerate(keys):
+                count = self._counts.get(key)
+                if count is None:
+                    missing.setdefault(key, []).append(i)
+                else:
+                    counts[i] = count
+
+        if missing:
+            missing_keys = list(missing)
+            missing_texts = [texts[missing[key][0]] for key in missing_keys]
+            encoded = enc.encode_batch(missing_texts, num_threads=self.num_threads)
+            with self._lock:
+                if len(self._counts) + len(missing_keys) > self.max_cached_texts:
+                    self._counts.clear()
+                for key, tokens in zip(missing_keys, encoded):
+                    self._counts[key] = len(tokens)
+                    counts[missing[key]] = len(tokens)
+
+        return counts
+
+
+tokenizer = Tokenizer()
+
+
+def count_tokens(prompt, model: str = "gpt-3.5-turbo"):
+    return tokenizer.count(prompt, model=model)
+
+
+@metrics.timed("tokenize", count_first_arg=True)
+def count_tokens_batch(texts, model: str = "gpt-3.5-turbo"):
+    return tokenizer.count_batch(list(texts), model=model)
+
+
+# Formatting tokens of a system and a user message plus the reply priming
+# (see _count_message_tokens)
+MESSAGE_OVERHEAD_TOKENS = 3 * 2 + 3
+
+
+def _estimate_summary_stage(
+    reviews: pd.DataFrame, instruction: str = "", model: str = "gpt-3.5-turbo"
+):
+    # Estimate the tokens of summarizing the reviews, following the same
+    # single-call vs. map-reduce decision as summarize_reviews
+    system_tokens = count_tokens(SUMMARY_SYSTEM_MESSAGE, model=model)
+    instruction_tokens = count_tokens(instruction, model=model)
+    map_overhead = (
+        system_tokens
+        + count_tokens(SUMMARY_PROMPT_HEADER, model=model)
+        + instruction_tokens
+        + MESSAGE_OVERHEAD_TOKENS
+    )
+    if "duplicate_count" in reviews.columns:
+        map_overhead += count_tokens(DUPLICATES_NOTE, model=model)
+    if "cluster" in reviews.columns:
+        map_overhead += count_tokens(THEMES_NOTE, model=model)
+    review_tokens = count_tokens_batch(format_reviews(reviews), model=model)
+    total_review_tokens = int(review_tokens.sum())
+
+    prompt_tokens = map_overhead - system_tokens - MESSAGE_OVERHEAD_TOKENS
+    if prompt_tokens + total_review_tokens <= max_prompt_tokens(model):
+        return {
+            "calls": 1,
+            "input_tokens": map_overhead + total_review_tokens,
+            "output_tokens": EXPECTED_OUTPUT_TOKENS,
+        }
+
+    # Map step: one call per chunk
+    n_summaries = len(_chunk_bounds(review_tokens, MAP_CHUNK_TOKENS))
+    calls = n_summaries
+    input_tokens = n_summaries * map_overhead + total_review_tokens
+
+    reduce_calls, reduce_input_tokens = _estimate_reduce_steps(
+        n_summaries, instruction, model=model
+    )
+    calls += reduce_calls
+    input_tokens += reduce_input_tokens
+
+    return {
+        "calls": calls,
+        "input_tokens": input_tokens,
+        "output_tokens": calls * EXPECTED_OUTPUT_TOKENS,
+    }
+
+
+def _estimate_reduce_steps(
+    n_summaries: int, instruction: str = "", model: str = "gpt-3.5-turbo"
+):
+    # Calls and input tokens of merging groups of partial summaries until
+    # one is left (see build_reduce_prompt)
+    reduce_overhead = (
+        count_tokens(SUMMARY_SYSTEM_MESSAGE, model=model)
+        + count_tokens(REDUCE_PROMPT_HEADER, model=model)
+        + count_tokens(instruction, model=model)
+        + MESSAGE_OVERHEAD_TOKENS
+    )
+    calls, input_tokens = 0, 0
+    while n_summaries > 1:
+        n_groups = -(-n_summaries // REDUCE_FAN_IN)
+        input_tokens += n_groups * reduce_overhead
+        # Each partial summary is preceded by a short "Partial summary i:" label
+        input_tokens += n_summaries * (EXPECTED_OUTPUT_TOKENS + 6)
+        calls += n_groups
+        n_summaries = n_groups
+    return calls, input_tokens
+
+
+def _estimate_recommendations_stage(
+    n_summaries: int, app_name: str = None, model: str = "gpt-3.5-turbo"
+):
+    return {
+        "calls": 1,
+        "input_tokens": count_tokens(RECOMMENDATIONS_SYSTEM_MESSAGE, model=model)
+        + count_tokens(build_recommendations_prompt([], app_name), model=model)
+        + n_summaries * EXPECTED_OUTPUT_TOKENS
+        + MESSAGE_OVERHEAD_TOKENS,
+        "output_tokens": EXPECTED_OUTPUT_TOKENS,
+    }
+
+
+def estimate_insights_cost(
+    positive_reviews: pd.DataFrame,
+    negative_reviews: pd.DataFrame,
+    app_name: str = None,
+    positive_instruction: str = "",
+    negative_instruction: str = "",
+    model: str = "gpt-3.5-turbo",
+):
+    stages = {}
+    if positive_reviews is not None and len(positive_reviews) > 0:
+        stages["Positive summary"] = _estimate_summary_stage(
+            positive_reviews, positive_instruction, model=model
+        )
+    if negative_reviews is not None and len(negative_reviews) > 0:
+        stages["Negative summary"] = _estimate_summary_stage(
+            negative_reviews, negative_instruction, model=model
+        )
+
+    if stages:
+        stages["Recommendations"] = _estimate_recommendations_stage(
+            len(stages), app_name, model=model
+        )
+
+    for stage in stages.values():
+        stage["cost"] = estimate_token_cost(
+            stage["input_tokens"], stage["output_tokens"], model_name=model
+        )
+    return stages
+
 
 def estimate_token_cost(input_token_count,
                         output_token_count,
                         model_name = "gpt-3.5-turbo"):
     
-    if model_name == "gpt-3.5-turbo":
-        cost_estimate = input_token_count * 0.0005 / 1000
-        cost_estimate += output_token_count * 0.0015 / 1000
-    elif model_name == "gpt-4-0125-preview":
-        cost_estimate = input_token_count * 0.01 / 1000
-        cost_estimate += output_token_count * 0.06 / 1000
-    else:
+    if model_name not in MODEL_PRICING:
         raise ValueError(f"Model name {model_name} is unknown.")
-    return cost_estimate
\ No newline at end of file
+    pricing = MODEL_PRICING[model_name]
+    cost_estimate = input_token_count * pricing["input"] / 1000
+    cost_estimate += output_token_count * pricing["output"] / 1000
+    return cost_estimate
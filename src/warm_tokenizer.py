@@ -0,0 +1,15 @@
+import sys
+
+from src.utils import TOKENIZER_CACHE_DIR, warm_tokenizer
+
+
+def main():
+    # Download the tokenizer's BPE files into the cache directory, so that the
+    # app can count tokens on hosts without network access
+    warm_tokenizer()
+    print(f"Tokenizer files are cached in {TOKENIZER_CACHE_DIR}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
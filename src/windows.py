@@ -0,0 +1,341 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import closing
+
+import numpy as np
+import pandas as pd
+
+from src.cache import DEFAULT_CACHE_DIR
+from src.dedup import collapse_near_duplicates
+from src.utils import (
+    EXPECTED_OUTPUT_TOKENS,
+    REDUCE_FAN_IN,
+    POSITIVE_INSTRUCTION,
+    NEGATIVE_INSTRUCTION,
+    _estimate_recommendations_stage,
+    _estimate_reduce_steps,
+    _estimate_summary_stage,
+    build_reduce_prompt,
+    estimate_token_cost,
+    get_llm_recommendations,
+    get_llm_summary,
+    summarize_reviews,
+)
+
+# Reviews are summarized per calendar week (Monday to Sunday)
+WINDOW_FREQ = "W-SUN"
+
+
+class WindowSummaryStore:
+    """Persistent summaries of the reviews of single time windows.
+
+    Summaries are keyed by the content of a window's reviews (together with
+    model and instruction), so unchanged windows are reused by every later
+    analysis that covers them, while windows with new reviews are
+    summarized again.
+    """
+
+    def __init__(self, path: str = os.path.join(DEFAULT_CACHE_DIR, "window_summaries.sqlite")):
+        self.path = path
+        self._initialized = False
+
+    def _connect(self):
+        if not self._initialized:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+
+        conn = sqlite3.connect(self.path, timeout=30)
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS window_summaries (
+                    key TEXT PRIMARY KEY,
+                    window_start TEXT NOT NULL,
+                    n_reviews INTEGER NOT NULL,
+                    summary TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+                """
+            )
+            self._initialized = True
+        return conn
+
+    def get(self, key: str):
+        try:
+            with closing(self._connect()) as conn:
+                row = conn.execute(
+                    "SELECT summary FROM window_summaries WHERE key = ?", (key,)
+                ).fetchone()
+        except sqlite3.Error:
+            # A broken store only means that windows are summarized again
+            return None
+        return row[0] if row is not None else None
+
+    def set(self, key: str, window_start: pd.Timestamp, n_reviews: int, summary: str):
+        try:
+            with closing(self._connect()) as conn, conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO window_summaries VALUES (?, ?, ?, ?, ?)",
+                    (key, str(window_start), n_reviews, summary, time.time()),
+                )
+        except sqlite3.Error:
+            pass
+
+
+def window_starts(dates: pd.Series, freq: str = WINDOW_FREQ):
+    # Start of the window every date falls into (NaT for missing dates)
+    return pd.to_datetime(dates, errors="coerce").dt.to_period(freq).dt.start_time
+
+
+def _canonical_window(window: pd.DataFrame):
+    # Reviews in a fixed order (by date, ties broken by content), so that the
+    # same reviews always give the same key and the same prompt
+    row_hashes = pd.util.hash_pandas_object(
+        window[["date", "title", "review", "rating"]], index=False
+    ).to_numpy()
+    dates = pd.to_datetime(window["date"], errors="coerce").to_numpy()
+    order = np.lexsort((row_hashes, dates))
+    return window.iloc[order], row_hashes[order]
+
+
+def window_key(row_hashes: np.ndarray, instruction: str, model: str, merge_duplicates: bool):
+    digest = hashlib.sha256(
+        json.dumps([model, instruction, merge_duplicates]).encode("utf-8")
+    )
+    digest.update(row_hashes.tobytes())
+    return digest.hexdigest()
+
+
+def _split_windows(
+    reviews: pd.DataFrame,
+    instruction: str,
+    model: str,
+    store: WindowSummaryStore,
+    merge_duplicates: bool,
+    freq: str,
+):
+    # The reviews of every window with its key and stored summary (if any)
+    if "date" not in reviews.columns:
+        raise ValueError("Summarizing reviews by week requires a date column.")
+
+    windows = []
+    for window_start, window in reviews.groupby(window_starts(reviews["date"], freq)):
+        window, row_hashes = _canonical_window(window)
+        key = window_key(row_hashes, instruction, model, merge_duplicates)
+        windows.append(
+            {
+                "window_start": window_start,
+                "n_reviews": len(window),
+                "key": key,
+                "reviews": window,
+                "summary": store.get(key) if store is not None else None,
+            }
+        )
+        windows[-1]["cached"] = windows[-1]["summary"] is not None
+    return windows
+
+
+def _window_reviews(window: dict, merge_duplicates: bool):
+    if merge_duplicates:
+        return collapse_near_duplicates(window["reviews"])
+    return window["reviews"]
+
+
+def summarize_windows(
+    reviews: pd.DataFrame,
+    instruction: str = "",
+    api_key: str = None,
+    model: str = "gpt-3.5-turbo",
+    store: WindowSummaryStore = None,
+    merge_duplicates: bool = True,
+    freq: str = WINDOW_FREQ,
+    max_workers: int = 4,
+    on_window=None,
+):
+    """Summarize the reviews of every window (calendar week by default).
+
+    Windows found in `store` are not summarized again. Reviews without a
+    date are left out. Returns one row per window with its start, number
+    of reviews, summary and whether it was loaded from the store.
+    `on_window(n_done, n_windows)` is called after each window.
+    """
+    windows = _split_windows(reviews, instruction, model, store, merge_duplicates, freq)
+
+    def summarize(window):
+        window_reviews = _window_reviews(window, merge_duplicates)
+        return summarize_reviews(window_reviews, instruction, api_key=api_key, model=model)
+
+    # Only new or changed windows need the model
+    missing = [window for window in windows if not window["cached"]]
+    n_done = len(windows) - len(missing)
+    if on_window is not None:
+        on_window(n_done, len(windows))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(summarize, window): window for window in missing}
+        for future in as_completed(futures):
+            window = futures[future]
+            window["summary"] = future.result()
+            if store is not None:
+                store.set(
+                    window["key"], window["window_start"], window["n_reviews"], window["summary"]
+                )
+            n_done += 1
+            if on_window is not None:
+                on_window(n_done, len(windows))
+
+    return pd.DataFrame(
+        windows, columns=["window_start", "n_reviews", "cached", "summary"]
+    )
+
+
+def compose_summaries(
+    summaries: list,
+    instruction: str = "",
+    api_key: str = None,
+    model: str = "gpt-3.5-turbo",
+    reduce_fan_in: int = REDUCE_FAN_IN,
+):
+    # Merge the window summaries in groups until a single one is left
+    if len(summaries) == 0:
+        return None
+    while len(summaries) > 1:
+        summaries = [
+            get_llm_summary(
+                build_reduce_prompt(summaries[i : i + reduce_fan_in]) + instruction,
+                api_key=api_key,
+                model=model,
+            )
+            for i in range(0, len(summaries), reduce_fan_in)
+        ]
+    return summaries[0]
+
+
+def windowed_summary(
+    reviews: pd.DataFrame,
+    instruction: str = "",
+    api_key: str = None,
+    model: str = "gpt-3.5-turbo",
+    store: WindowSummaryStore = None,
+    merge_duplicates: bool = True,
+    on_window=None,
+):
+    windows = summarize_windows(
+        reviews,
+        instruction,
+        api_key=api_key,
+        model=model,
+        store=store,
+        merge_duplicates=merge_duplicates,
+        on_window=on_window,
+    )
+    summary = compose_summaries(
+        windows["summary"].tolist(), instruction, api_key=api_key, model=model
+    )
+    return summary, windows
+
+
+def generate_windowed_insights(
+    reviews: pd.DataFrame,
+    app_name: str,
+    api_key: str = None,
+    model: str = "gpt-3.5-turbo",
+    store: WindowSummaryStore = None,
+    merge_duplicates: bool = True,
+    on_window=None,
+):
+    """Like `generate_insights`, but the summaries are composed from weekly
+    summaries (see `summarize_windows`). Returns both summaries,
+    recommendations and the weekly summaries of both sentiments."""
+    positive_summary, positive_windows = windowed_summary(
+        reviews[reviews["rating"] > 3],
+        POSITIVE_INSTRUCTION,
+        api_key=api_key,
+        model=model,
+        store=store,
+        merge_duplicates=merge_duplicates,
+        on_window=on_window,
+    )
+    negative_summary, negative_windows = windowed_summary(
+        reviews[reviews["rating"] < 4],
+        NEGATIVE_INSTRUCTION,
+        api_key=api_key,
+        model=model,
+        store=store,
+        merge_duplicates=merge_duplicates,
+        on_window=on_window,
+    )
+
+    recommendations = None
+    if positive_summary is not None or negative_summary is not None:
+        recommendations = get_llm_recommendations(
+            [positive_summary, negative_summary], app_name, api_key=api_key, model=model
+        )
+
+    windows = pd.concat(
+        [
+            positive_windows.assign(sentiment="positive"),
+            negative_windows.assign(sentiment="negative"),
+        ],
+        ignore_index=True,
+    )
+    return positive_summary, negative_summary, recommendations, windows
+
+
+def estimate_windowed_cost(
+    reviews: pd.DataFrame,
+    app_name: str = None,
+    model: str = "gpt-3.5-turbo",
+    store: WindowSummaryStore = None,
+    merge_duplicates: bool = True,
+):
+    """Like `estimate_insights_cost`, for `generate_windowed_insights`.
+
+    Only windows without a summary in `store` are counted, as the others are
+    reused. Composing the window summaries and the recommendations are
+    always counted.
+    """
+    stages = {}
+    for stage_name, sentiment_reviews, instruction in [
+        ("Positive summary", reviews[reviews["rating"] > 3], POSITIVE_INSTRUCTION),
+        ("Negative summary", reviews[reviews["rating"] < 4], NEGATIVE_INSTRUCTION),
+    ]:
+        windows = _split_windows(
+            sentiment_reviews, instruction, model, store, merge_duplicates, WINDOW_FREQ
+        )
+        if not windows:
+            continue
+
+        stage = {"calls": 0, "input_tokens": 0, "output_tokens": 0}
+        for window in windows:
+            if window["cached"]:
+                continue
+            window_stage = _estimate_summary_stage(
+                _window_reviews(window, merge_duplicates), instruction, model=model
+            )
+            for name in stage:
+                stage[name] += window_stage[name]
+
+        # Compose the summaries of all windows, stored ones included
+        reduce_calls, reduce_input_tokens = _estimate_reduce_steps(
+            len(windows), instruction, model=model
+        )
+        stage["calls"] += reduce_calls
+        stage["input_tokens"] += reduce_input_tokens
+        stage["output_tokens"] += reduce_calls * EXPECTED_OUTPUT_TOKENS
+        stages[stage_name] = stage
+
+    if stages:
+        stages["Recommendations"] = _estimate_recommendations_stage(
+            len(stages), app_name, model=model
+        )
+
+    for stage in stages.values():
+        stage["cost"] = estimate_token_cost(
+            stage["input_tokens"], stage["output_tokens"], model_name=model
+        )
+    return stages
@@ -2,16 +2,52 @@ import streamlit as st
 from src.utils import (
     app_store_reviews,
     app_store_reviews_with_timeout,
-    build_prompt,
-    get_llm_summary,
-    get_llm_recommendations,
+    generate_insights,
+    split_reviews,
+    compact_reviews,
+    dataset_fingerprint,
+    POSITIVE_INSTRUCTION,
+    NEGATIVE_INSTRUCTION,
+    stream_reviews_summary,
+    stream_llm_recommendations,
     app_data_from_url,
-    count_tokens,
-    estimate_token_cost,
+    estimate_insights_cost,
+    warm_tokenizer,
 )
+from src.review_store import ReviewStore
+from src.jobs import JobManager
+from src.analytics import (
+    KEYWORD_SAMPLE_SIZE,
+    RATINGS,
+    rating_distribution,
+    rating_trend,
+    sentiment_buckets,
+    top_ngrams,
+    wordcloud_png,
+)
+from src.windows import (
+    WindowSummaryStore,
+    estimate_windowed_cost,
+    generate_windowed_insights,
+)
+from src.instrumentation import metrics, start_prometheus_server
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from src.ingest import load_reviews
 import datetime
 import pandas as pd
 
+# Maximum number of uploaded reviews kept in memory (larger files are sampled)
+MAX_UPLOADED_REVIEWS = 100_000
+
+# Lifetime (in seconds) and size of the caches for reviews and derived data
+CACHE_TTL = 60 * 60
+CACHE_MAX_ENTRIES = 100
+
+# Number of reviews to summarize per sentiment when selecting by theme
+REPRESENTATIVE_REVIEWS = 300
+
 st.title("App Review Summaries 📱")
 
 st.subheader("Get AI-powered insights from App Store reviews")
@@ -29,10 +65,8 @@ if "data_source" not in st.session_state:
     st.session_state.data_source = None
 if "app_store_url" not in st.session_state:
     st.session_state.app_store_url = None
-if "prompt_positive" not in st.session_state:
-    st.session_state.prompt_positive = None
-if "prompt_negative" not in st.session_state:
-    st.session_state.prompt_negative = None
+if "reviews_fingerprint" not in st.session_state:
+    st.session_state.reviews_fingerprint = None
 
 # Data source selection
 data_source = st.radio(
@@ -88,16 +122,18 @@ elif "Upload" in data_source:
 
     st.info(
         """
-**Your file with app store reviews should be in .csv format and contain the following columns**:  
+**Your file with app store reviews should be in .csv format (optionally gzipped) or .parquet format and contain the following columns**:  
 - `title`: The review's title text
 - `review`: The review's content text
 - `rating`: The review's star rating (a number in the range of 1—5)   
 
-Other columns can be present but will be ignored. If you upload more than 500 reviews, only a random sample of 500 reviews will be used.
-                """
+Other columns can be present but will be ignored. Large files are summarized in chunks, which takes a bit longer. If you upload more than {max_reviews:,} reviews, a random sample of {max_reviews:,} reviews (keeping the share of each rating) will be used.
+                """.format(max_reviews=MAX_UPLOADED_REVIEWS)
     )
 
-    uploaded_file = st.file_uploader("Upload your **.csv file** here")
+    uploaded_file = st.file_uploader(
+        "Upload your **.csv file** here", type=["csv", "gz", "parquet"]
+    )
 
     st.warning(
         """
@@ -147,12 +183,59 @@ with st.expander("Advanced settings"):
                  You will receive a cost estimate before any API calls are made."
         )
 
+    # Near-duplicates
+    merge_duplicates = st.checkbox(
+        "**Merge near-duplicate reviews** before summarizing",
+        value=True,
+        help="Near-identical reviews are sent only once, together with \
+                their count. This reduces cost without losing how often \
+                feedback was given.",
+    )
+
+    # Themes
+    select_representatives = st.checkbox(
+        "**Summarize large datasets by theme**",
+        value=True,
+        help=f"If there are more than {REPRESENTATIVE_REVIEWS} positive or \
+                negative reviews, they are grouped into themes and only the \
+                most representative reviews of each theme are summarized.",
+    )
+
+    # Streaming
+    stream_responses = st.checkbox(
+        "**Stream** the insights while they are being generated",
+        value=True,
+        help="Both summaries are generated in parallel in the background, so \
+                changing settings does not restart them. Without streaming, \
+                they are shown once all insights are complete.",
+    )
+
+    # Weekly summaries
+    summarize_by_week = st.checkbox(
+        "**Summarize week by week** and reuse the summaries of earlier analyses",
+        value=False,
+        help="Reviews are summarized per calendar week and the weekly \
+                summaries are combined. Weeks that were summarized before \
+                (e.g. for a shorter date range) are not summarized again. \
+                Requires review dates and disables streaming.",
+    )
+
+    # Debugging
+    show_debug_panel = st.checkbox(
+        "Show **debug panel** with timings and token usage",
+        value=False,
+    )
+
     # Timeout
     if st.session_state.data_source == "app_store":
         timeout = st.number_input(
             "Scraping reviews can take time. Change the timeout (in seconds) below.",
             value=60,
         )
+        return_partial = st.checkbox(
+            "Use the reviews loaded until the timeout instead of failing",
+            value=True,
+        )
 
 # Assign api_key variable for easier/safer logic flow later
 if len(api_key_input) == 0:
@@ -161,13 +244,229 @@ else:
     api_key = api_key_input
 
 
-# Define function for scraping reviews with caching
-@st.cache_data
-def get_reviews():
+# Optional Prometheus endpoint for the pipeline metrics (started once per process)
+@st.cache_resource
+def start_metrics_endpoint(port):
+    return start_prometheus_server(port)
+
+
+if os.environ.get("USER_REVIEWS_METRICS_PORT"):
+    start_metrics_endpoint(int(os.environ["USER_REVIEWS_METRICS_PORT"]))
+
+
+# Load the tokenizer in the background once per process, so that the first
+# cost estimate does not wait for it
+@st.cache_resource
+def start_tokenizer_warm_up():
+    thread = threading.Thread(target=warm_tokenizer, daemon=True)
+    thread.start()
+    return thread
+
+
+start_tokenizer_warm_up()
+
+
+# Local review store shared by all sessions
+@st.cache_resource
+def get_review_store():
+    return ReviewStore()
+
+
+# Weekly summaries shared by all sessions
+@st.cache_resource
+def get_window_store():
+    return WindowSummaryStore()
+
+
+# Worker pool shared by all sessions, so that long-running work survives reruns
+@st.cache_resource
+def get_job_manager():
+    return JobManager(ttl_seconds=CACHE_TTL, max_finished_jobs=CACHE_MAX_ENTRIES)
+
+
+def scrape_reviews_job(job, url, start_date, end_date, timeout, return_partial, store):
+    job.update(message="Loading reviews from the App Store...")
     reviews = app_store_reviews_with_timeout(
-        url=app_store_url, start_date=start_date, end_date=end_date, timeout=timeout
+        url=url,
+        start_date=start_date,
+        end_date=end_date,
+        timeout=timeout,
+        store=store,
+        return_partial=return_partial,
+        stop_event=job.stop_event,
+    )
+    # The scraper is only stopped early on a timeout, the next request for
+    # the same reviews scrapes again instead of reusing the partial result
+    job.partial = job.stop_event.is_set()
+    # The job keeps its result for later requests, so it keeps the compact
+    # copy that is shared with the sessions (not a second, raw one)
+    return compact_reviews(reviews)
+
+
+def insights_job(job, **kwargs):
+    job.update(message="Summarizing reviews and generating recommendations...")
+    return generate_insights(**kwargs)
+
+
+def streamed_insights_job(
+    job, positive_reviews, negative_reviews, app_name, api_key, model
+):
+    # Streams both summaries (concurrently) and then the recommendations
+    # into the job, which pages follow while they are generated
+    job.update(message="Summarizing reviews and generating recommendations...")
+    job.usage.update(positive={}, negative={}, recommendations={})
+
+    def stream_summary(stream, reviews, instruction):
+        try:
+            if len(reviews) == 0:
+                return None
+            for delta in stream_reviews_summary(
+                reviews,
+                instruction=instruction,
+                api_key=api_key,
+                model=model,
+                usage=job.usage[stream],
+            ):
+                job.append(stream, delta)
+            return job.streams.get(stream, "")
+        finally:
+            job.close_stream(stream)
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        positive = executor.submit(
+            stream_summary, "positive", positive_reviews, POSITIVE_INSTRUCTION
+        )
+        negative = executor.submit(
+            stream_summary, "negative", negative_reviews, NEGATIVE_INSTRUCTION
+        )
+        positive_summary, negative_summary = positive.result(), negative.result()
+
+    recommendations = None
+    try:
+        if positive_summary is not None or negative_summary is not None:
+            for delta in stream_llm_recommendations(
+                summaries=[positive_summary, negative_summary],
+                app_name=app_name,
+                api_key=api_key,
+                model=model,
+                usage=job.usage["recommendations"],
+            ):
+                job.append("recommendations", delta)
+            recommendations = job.streams.get("recommendations", "")
+    finally:
+        job.close_stream("recommendations")
+    return positive_summary, negative_summary, recommendations
+
+
+def windowed_insights_job(job, **kwargs):
+    def on_window(n_done, n_windows):
+        job.update(
+            progress=n_done / max(n_windows, 1),
+            message=f"Summarizing reviews week by week ({n_done} of {n_windows} weeks)...",
+        )
+
+    return generate_windowed_insights(on_window=on_window, **kwargs)
+
+
+def wait_for_job(job_id, message):
+    # Attach to a (possibly already running) job and show its progress.
+    # Widget interactions rerun the script, but not the job itself.
+    job = get_job_manager().get(job_id)
+    if job is None:
+        return None
+
+    progress_bar = st.progress(job.progress, text=job.message or message)
+    while not job.wait(timeout=0.5):
+        progress_bar.progress(job.progress, text=job.message or message)
+    progress_bar.empty()
+
+    if job.status == "failed":
+        raise job.error
+    return job.result
+
+
+def follow_job_stream(job, stream):
+    # Show the text of a (possibly already running) job's stream as it grows
+    yield from job.follow(stream)
+    if job.status == "failed":
+        raise job.error
+
+
+# Scraped reviews are reused from the finished job per URL, date range and
+# scraping settings (unless scraping timed out and the result is partial)
+def get_reviews(url, start_date, end_date, timeout, return_partial):
+    # Start scraping in the background (or attach to a running job)
+    scrape_job_id = get_job_manager().submit(
+        scrape_reviews_job,
+        url,
+        start_date,
+        end_date,
+        timeout,
+        return_partial,
+        get_review_store(),
+        key=("scrape", url, start_date, end_date, timeout, return_partial),
+    )
+    return wait_for_job(scrape_job_id, "Loading reviews... (this may take a while!)")
+
+
+# Loaded datasets are kept once in a compact form and shared read-only by all
+# sessions that load the same reviews
+@st.cache_resource(ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def get_shared_reviews(fingerprint, _reviews):
+    return _reviews
+
+
+# Review splits are computed once per dataset and settings and shared read-only
+@st.cache_resource(ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def get_review_splits(fingerprint, merge_duplicates, select_representatives, _reviews):
+    # Merge near-duplicates and select representative reviews per theme for
+    # large datasets
+    return split_reviews(
+        _reviews,
+        merge_duplicates=merge_duplicates,
+        max_representative_reviews=(
+            REPRESENTATIVE_REVIEWS if select_representatives else None
+        ),
     )
-    return reviews
+
+
+# Token counts and costs are cached per dataset and analysis settings
+# (the reviews themselves are identified by their fingerprint, not hashed again)
+@st.cache_data(ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def get_cost_stages(
+    fingerprint,
+    merge_duplicates,
+    select_representatives,
+    model,
+    summarize_by_week,
+    _reviews,
+    _positive_reviews,
+    _negative_reviews,
+):
+    if summarize_by_week:
+        # Weeks summarized since the estimate are reused, so a cached estimate
+        # can only be too high
+        return estimate_windowed_cost(
+            _reviews,
+            model=model,
+            store=get_window_store(),
+            merge_duplicates=merge_duplicates,
+        )
+    return estimate_insights_cost(
+        _positive_reviews,
+        _negative_reviews,
+        positive_instruction=POSITIVE_INSTRUCTION,
+        negative_instruction=NEGATIVE_INSTRUCTION,
+        model=model,
+    )
+
+
+# Statistics without AI are cached per dataset
+@st.cache_data(ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def get_overview(fingerprint, _reviews):
+    trend = rating_trend(_reviews) if "date" in _reviews.columns else None
+    keywords = top_ngrams(_reviews, buckets=sentiment_buckets(_reviews), top_n=50)
+    return rating_distribution(_reviews), trend, keywords
 
 
 # STAGE LOGIC
@@ -200,39 +499,43 @@ if st.session_state.stage > 0:
 
     # Load reviews if not already done
     if st.session_state.reviews is None:
+        loaded_reviews = None
 
         # Option 1: Scrape review data
         if st.session_state.data_source == "app_store":
-            with st.spinner("Loading reviews... (this may take a while!)"):
-                if start_date and end_date:
-                    if start_date < end_date:
-                        # Store reviews in session state
-                        st.session_state.reviews = get_reviews()
+            # Imported here, the scraper's dependencies are slow to import
+            from src.scraping import RateLimitError
+
+            if start_date and end_date:
+                if start_date < end_date:
+                    # Scrape reviews (or reuse them from the cache)
+                    try:
+                        loaded_reviews = get_reviews(
+                            app_store_url, start_date, end_date, timeout, return_partial
+                        )
+                    except RateLimitError as e:
+                        st.error(
+                            f"The App Store is limiting requests at the moment ({e}) \
+                                Please try again in a few minutes."
+                        )
+                        st.stop()
 
         # Option 2: Read demo data
         elif st.session_state.data_source == "demo":
-            st.session_state.reviews = pd.read_csv("reviews_test_data.csv")
+            loaded_reviews = pd.read_csv("reviews_test_data.csv")
 
         # Option 3: Read uploaded file
         elif st.session_state.data_source == "upload":
             if uploaded_file is not None:
-                st.session_state.reviews = pd.read_csv(uploaded_file)
-                # Check if the required columns are present
-                required_columns = ["title", "review", "rating"]
-                if not all(
-                    col in st.session_state.reviews.columns for col in required_columns
-                ):
-                    raise ValueError(
-                        'The uploaded file does not contain the required columns "title", "review", and "rating".'
-                    )
-                
-                # If the file is larger than 500 rows, only use a random sample of 500 rows
-                if len(st.session_state.reviews) > 500:
-                    st.session_state.reviews = st.session_state.reviews.sample(500)
+                # Read only the review columns, sampling large files on the fly
+                loaded_reviews, n_uploaded_reviews = load_reviews(
+                    uploaded_file, max_reviews=MAX_UPLOADED_REVIEWS
+                )
 
-                    # Warn the user about the sample
+                # Warn the user about the sample
+                if n_uploaded_reviews > MAX_UPLOADED_REVIEWS:
                     st.warning(
-                        "The uploaded file contains more than 500 reviews. A random sample of 500 reviews will be used for the analysis."
+                        f"The uploaded file contains {n_uploaded_reviews:,} reviews. A random sample of {MAX_UPLOADED_REVIEWS:,} reviews will be used for the analysis."
                     )
 
             else:
@@ -240,71 +543,100 @@ if st.session_state.stage > 0:
                     "A review file could not be found. Please reload the page and try uploading your file again."
                 )
 
+        # Keep one compact copy per dataset, fingerprinted once (derived data
+        # is keyed by the fingerprint). Scraped reviews are compacted by their job.
+        if loaded_reviews is not None:
+            if st.session_state.data_source != "app_store":
+                loaded_reviews = compact_reviews(loaded_reviews)
+            st.session_state.reviews_fingerprint = dataset_fingerprint(loaded_reviews)
+            st.session_state.reviews = get_shared_reviews(
+                st.session_state.reviews_fingerprint, loaded_reviews
+            )
+
         # If the user did not give an API key, proceed to analysis
         # (Otherwise, the API cost estimation section will show first.)
         if api_key is None:
             st.session_state.stage = 2
 
-    positive_reviews = st.session_state.reviews[
-        st.session_state.reviews["rating"] > 3
-    ].sample(frac=1)
-    negative_reviews = st.session_state.reviews[
-        st.session_state.reviews["rating"] < 4
-    ].sample(frac=1)
+    fingerprint = st.session_state.reviews_fingerprint
 
-    # Build prompts for all summaries
-    if len(positive_reviews) > 0:
-        st.session_state.prompt_positive = build_prompt(
-            st.session_state.reviews[st.session_state.reviews["rating"] > 3].sample(
-                frac=1
-            )
-        )
-        st.session_state.prompt_positive += "\n\nFor this analysis, only the positive reviews have been selected. \
-            Please summarize the positive highlights in the user feedback."
+    # Split reviews by sentiment
+    positive_reviews, negative_reviews = get_review_splits(
+        fingerprint, merge_duplicates, select_representatives, st.session_state.reviews
+    )
 
-    if len(negative_reviews) > 0:
-        st.session_state.prompt_negative = build_prompt(
-            st.session_state.reviews[st.session_state.reviews["rating"] < 4].sample(
-                frac=1
-            )
-        )
-        st.session_state.prompt_negative += "\n\nFor this analysis, only critical reviews have been selected. \
-        Please summarize the key critical issues raised in the user feedback."
+    # Checked before the cost estimate, which depends on the mode
+    if summarize_by_week and "date" not in st.session_state.reviews.columns:
+        st.warning("The reviews have no dates, so they cannot be summarized week by week.")
+        summarize_by_week = False
 
 ###################
-# API COST ESTIMATE
+# OVERVIEW
 ###################
 
-if st.session_state.stage > 0 and api_key is not None:
+if st.session_state.stage > 0:
 
-    st.header("API Cost Estimation")
+    st.header("Overview")
 
-    # Estimate input token amount and API cost
-    input_token_count_total = 0
+    st.caption("These statistics are computed without AI and are free of charge.")
 
-    # Add input token amount for summaries
-    if st.session_state.prompt_positive is not None:
-        input_token_count_prompt_positive = count_tokens(
-            st.session_state.prompt_positive
-        )
-        input_token_count_total += input_token_count_prompt_positive
-    if st.session_state.prompt_negative is not None:
-        input_token_count_prompt_negative = count_tokens(
-            st.session_state.prompt_negative
+    rating_counts, rating_trend_by_week, keywords = get_overview(
+        fingerprint, st.session_state.reviews
+    )
+
+    # Rating distribution, over time if the reviews span several weeks
+    if rating_trend_by_week is not None and len(rating_trend_by_week) > 1:
+        st.markdown("**Reviews per week and star rating**")
+        st.bar_chart(
+            rating_trend_by_week[RATINGS].rename(columns=lambda rating: f"{rating} ★")
         )
-        input_token_count_total += input_token_count_prompt_negative
+    else:
+        st.markdown("**Reviews per star rating**")
+        st.bar_chart(rating_counts.rename(index=lambda rating: f"{rating} ★"))
+
+    # Frequent words and phrases per sentiment
+    for column, bucket, title in zip(
+        st.columns(2),
+        ["positive", "negative"],
+        ["Frequent terms in positive reviews", "Frequent terms in critical reviews"],
+    ):
+        with column:
+            st.markdown(f"**{title}**")
+            bucket_keywords = keywords[keywords["bucket"] == bucket]
+            wordcloud = wordcloud_png(
+                dict(zip(bucket_keywords["term"], bucket_keywords["reviews"]))
+            )
+            if wordcloud is None:
+                st.write("Not enough reviews to find frequent terms.")
+            else:
+                st.image(wordcloud)
+                with st.expander("Show terms"):
+                    if len(st.session_state.reviews) > KEYWORD_SAMPLE_SIZE:
+                        st.caption(
+                            f"Estimated from a random sample of {KEYWORD_SAMPLE_SIZE:,} reviews."
+                        )
+                    st.dataframe(bucket_keywords[["term", "reviews"]], hide_index=True)
 
-    # Add estimated input token amount for recommendations
-    input_token_count_total += 500  # heuristic value based on common summary outputs
+###################
+# API COST ESTIMATE
+###################
 
-    # Add estimated output token amount
-    output_token_count_total = 1000
+if st.session_state.stage > 0 and api_key is not None:
 
-    token_cost = estimate_token_cost(
-        input_token_count=input_token_count_total,
-        output_token_count=output_token_count_total,
-        model_name=model_name,
+    st.header("API Cost Estimation")
+
+    # Estimate token amounts and API cost per stage
+    cost_stages = get_cost_stages(
+        fingerprint,
+        merge_duplicates,
+        select_representatives,
+        model_name,
+        summarize_by_week,
+        st.session_state.reviews,
+        positive_reviews,
+        negative_reviews,
     )
+    token_cost = sum(stage["cost"] for stage in cost_stages.values())
 
     if round(token_cost, 2) == 0:
         token_cost_explanation = "less than $0.01"
@@ -329,6 +661,18 @@ if st.session_state.stage > 0 and api_key is not None:
                  **{token_cost_explanation}** (based on input and output token estimates)."
     )
 
+    with st.expander("Show cost per stage"):
+        st.dataframe(
+            pd.DataFrame.from_dict(cost_stages, orient="index").rename(
+                columns={
+                    "calls": "API calls",
+                    "input_tokens": "Input tokens",
+                    "output_tokens": "Output tokens (estimated)",
+                    "cost": "Cost (USD)",
+                }
+            )
+        )
+
     st.markdown(
         f"**Would you like to continue and use {token_cost_explanation} of your OpenAI API credits?**"
     )
@@ -374,17 +718,93 @@ if st.session_state.stage > 1:
 
     st.write(f"")
 
+    def show_usage(usage):
+        if usage.get("cached"):
+            st.caption("Loaded from cache, no tokens used")
+        elif usage:
+            st.caption(
+                f"{usage['prompt_tokens']} input tokens, {usage['completion_tokens']} output tokens"
+            )
+
+    # Compose the summaries from (partly stored) weekly summaries
+    if summarize_by_week:
+        stream_responses = False
+        windowed_insights_job_id = get_job_manager().submit(
+            windowed_insights_job,
+            reviews=st.session_state.reviews,
+            app_name=app_name,
+            api_key=api_key,
+            model=model_name,
+            store=get_window_store(),
+            merge_duplicates=merge_duplicates,
+            key=("windowed_insights", fingerprint, model_name, merge_duplicates),
+        )
+        positive_summary, negative_summary, recommendations, windows = wait_for_job(
+            windowed_insights_job_id, "Summarizing reviews week by week..."
+        )
+
+        with st.expander("Show weekly summaries"):
+            st.caption(
+                f"{int(windows['cached'].sum())} of {len(windows)} weekly summaries were reused from earlier analyses."
+            )
+            st.dataframe(windows)
+
+    # Streamed insights are generated in a job as well, so that reruns attach
+    # to the running generation instead of starting it again
+    elif stream_responses:
+        positive_summary, negative_summary, recommendations = None, None, None
+        streamed_insights_job_id = get_job_manager().submit(
+            streamed_insights_job,
+            positive_reviews=positive_reviews,
+            negative_reviews=negative_reviews,
+            app_name=app_name,
+            api_key=api_key,
+            model=model_name,
+            key=(
+                "streamed_insights",
+                fingerprint,
+                model_name,
+                merge_duplicates,
+                select_representatives,
+            ),
+        )
+        streamed_insights_job = get_job_manager().get(streamed_insights_job_id)
+
+    # Without streaming, generate all insights up front (both summaries run concurrently)
+    else:
+        insights_job_id = get_job_manager().submit(
+            insights_job,
+            positive_reviews=positive_reviews,
+            negative_reviews=negative_reviews,
+            app_name=app_name,
+            positive_instruction=POSITIVE_INSTRUCTION,
+            negative_instruction=NEGATIVE_INSTRUCTION,
+            api_key=api_key,
+            model=model_name,
+            key=(
+                "insights",
+                fingerprint,
+                model_name,
+                merge_duplicates,
+                select_representatives,
+            ),
+        )
+        positive_summary, negative_summary, recommendations = wait_for_job(
+            insights_job_id, "Summarizing reviews and generating recommendations..."
+        )
+
     # Generate "highlights" section
     st.subheader("🤩 Highlights")
 
-    positive_summary = None
-    if st.session_state.prompt_positive is not None:
-        with st.spinner("Summarizing positive reviews..."):
-            positive_summary = get_llm_summary(
-                st.session_state.prompt_positive, api_key=api_key, model=model_name
-            )
+    if len(positive_reviews) > 0:
         st.write("The following points were highlighted by satisfied users:")
-        st.markdown(positive_summary)
+        if stream_responses:
+            positive_summary = st.write_stream(
+                follow_job_stream(streamed_insights_job, "positive")
+            )
+            show_usage(streamed_insights_job.usage.get("positive", {}))
+        else:
+            st.markdown(positive_summary)
     else:
         st.write(
             "No positive reviews (> 3 stars) were found. A summary cannot be created."
@@ -393,14 +813,15 @@ if st.session_state.stage > 1:
     # Generate "room for improvement" section
     st.subheader("🤔 Problems")
 
-    negative_summary = None
-    if st.session_state.prompt_negative is not None:
-        with st.spinner("Summarizing negative reviews..."):
-            negative_summary = get_llm_summary(
-                st.session_state.prompt_negative, api_key=api_key, model=model_name
-            )
+    if len(negative_reviews) > 0:
         st.write("The following issues were raised by dissatisfied users:")
-        st.markdown(negative_summary)
+        if stream_responses:
+            negative_summary = st.write_stream(
+                follow_job_stream(streamed_insights_job, "negative")
+            )
+            show_usage(streamed_insights_job.usage.get("negative", {}))
+        else:
+            st.markdown(negative_summary)
     else:
         st.write(
             "No negative reviews (< 4 stars) were found. A summary cannot be created."
@@ -408,20 +829,18 @@ if st.session_state.stage > 1:
 
     # Generate "recommendations" section
     st.subheader("🧭 Recommended improvements")
-    summaries = [positive_summary, negative_summary]
 
     if positive_summary is not None or negative_summary is not None:
-        with st.spinner("Generating recommendations..."):
-            recommendations = get_llm_recommendations(
-                summaries=summaries,
-                api_key=api_key,
-                app_name=app_name,
-                model=model_name,
-            )
         st.write(
             "Based on the user feedback, consider the following product recommendations:"
         )
-        st.markdown(recommendations)
+        if stream_responses:
+            recommendations = st.write_stream(
+                follow_job_stream(streamed_insights_job, "recommendations")
+            )
+            show_usage(streamed_insights_job.usage.get("recommendations", {}))
+        else:
+            st.markdown(recommendations)
     else:
         st.write("No reviews were found.")
 
@@ -433,3 +852,25 @@ if st.session_state.stage > 1:
 For a new analysis, please reload the page.
 """
     )
+
+
+###################
+# DEBUG PANEL
+###################
+
+if show_debug_panel:
+    st.markdown("---")
+    st.header("Debug panel")
+    st.caption("Metrics are collected for the whole server process since it started.")
+
+    st.subheader("Time per stage")
+    stage_summary = pd.DataFrame.from_dict(metrics.summary(), orient="index")
+    if len(stage_summary) > 0:
+        stage_summary["mean seconds"] = stage_summary["seconds"] / stage_summary["calls"]
+    st.dataframe(stage_summary)
+
+    st.subheader("Token usage per model")
+    st.dataframe(pd.DataFrame.from_dict(metrics.token_usage(), orient="index"))
+
+    with st.expander("Recent events"):
+        st.dataframe(pd.DataFrame(metrics.events()[-200:]))